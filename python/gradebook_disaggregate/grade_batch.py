@@ -0,0 +1,113 @@
+"""Grade many Schoology exports in parallel and merge them per student.
+
+Usage: python grade_batch.py [--rules rules.json] report.json exports/ more.csv
+
+Each export is streamed row by row in a worker process, so memory stays
+bounded by the number of students rather than the size of the files. The
+merged report is written as json, or csv if the output name ends in .csv.
+"""
+
+import os
+import csv
+import sys
+import glob
+import json
+import functools
+import multiprocessing as mp
+import grade_report
+
+
+def find_exports(paths):
+  """Expand directories into the csv files they contain."""
+  files = []
+  for path in paths:
+    if os.path.isdir(path):
+      files += sorted(glob.glob(os.path.join(path, '*.csv')))
+    else:
+      files.append(path)
+  return files
+
+
+def section_names(files):
+  """Pair each export with its path from the common directory, sans extension.
+
+  Exports from one directory keep their bare file names, while same-named
+  files from different directories become e.g. fall/algebra and
+  spring/algebra. A file listed twice is graded once.
+  """
+  paths = [os.path.abspath(file_name) for file_name in files]
+  if not paths:
+    return []
+  root = os.path.commonpath([os.path.dirname(path) for path in paths])
+  sections = {}
+  exports = []
+  for file_name, path in zip(files, paths):
+    section = os.path.splitext(os.path.relpath(path, root))[0].replace(os.sep, '/')
+    if section in sections:
+      if sections[section] != path:
+        raise ValueError('{} and {} would both be section {}'.format(
+            sections[section], path, section))
+      continue
+    sections[section] = path
+    exports.append((file_name, section))
+  return exports
+
+
+def grade_section(export, rules=grade_report.DEFAULT_RULES):
+  """Return the section name and the grades of every student in one export."""
+  file_name, section = export
+  return section, list(grade_report.grade_file(file_name, rules))
+
+
+def student_key(grades):
+  """Identify a student by user id, falling back to their name."""
+  if grades['id']:
+    return grades['id']
+  return '{}, {}'.format(grades['last'], grades['first'])
+
+
+def merge_exports(files, rules=grade_report.DEFAULT_RULES, processes=None):
+  """Grade files across a process pool and group the results by student.
+
+  Sections are merged in the order of `files`, so a student's name comes
+  from the first export listing them, however the workers are scheduled.
+  """
+  students = {}
+  grade = functools.partial(grade_section, rules=rules)
+  exports = section_names(files)
+  with mp.Pool(processes) as pool:
+    for section, section_grades in pool.imap(grade, exports):
+      for grades in section_grades:
+        student = students.setdefault(student_key(grades), {
+            'id': grades['id'], 'first': grades['first'],
+            'last': grades['last'], 'sections': {}})
+        student['sections'][section] = grades['periods']
+  return dict(sorted(students.items()))
+
+
+def write_report(students, output):
+  """Write the merged report as json, or one row per student period as csv."""
+  if output.endswith('.csv'):
+    with open(output, 'w', newline='') as f:
+      writer = csv.writer(f)
+      writer.writerow(['id', 'first', 'last', 'section', 'period', 'grade'])
+      for student in students.values():
+        for section, periods in sorted(student['sections'].items()):
+          for period, grade in periods.items():
+            writer.writerow([student['id'], student['first'], student['last'],
+                             section, period, grade])
+  else:
+    with open(output, 'w') as f:
+      json.dump(students, f, indent=2)
+
+
+if __name__ == '__main__':
+  args = sys.argv[1:]
+  grading_rules = grade_report.DEFAULT_RULES
+  if args[0] == '--rules':
+    grading_rules = grade_report.load_rules(args[1])
+    args = args[2:]
+  export_files = find_exports(args[1:])
+  merged = merge_exports(export_files, grading_rules)
+  write_report(merged, args[0])
+  print('Merged {} exports into {} students.'.format(len(export_files), len(merged)))
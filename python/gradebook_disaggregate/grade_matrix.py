@@ -0,0 +1,153 @@
+"""Vectorized period grades for a whole Schoology export at once.
+
+The export is loaded once into a students x assignments score matrix, with
+non-numeric cells (Excused, blank, ...) masked out, and the weighted period
+grades for every student come from matrix products with the header index from
+grade_report. Output matches grade_report line for line.
+"""
+
+import io
+import os
+import csv
+import sys
+import time
+import random
+import tempfile
+import operator
+import contextlib
+import datetime as dt
+import numpy as np
+import grade_report
+
+
+class ScoreCache(dict):
+  """Map cell text to int(text), or NaN where grade_report would skip it.
+
+  Each distinct text is converted once; later lookups are plain dict hits.
+  """
+
+  def __missing__(self, text):
+    try:
+      value = int(text)
+    except ValueError:
+      value = np.nan
+    self[text] = value
+    return value
+
+
+def load_scores(file_name, rules=grade_report.DEFAULT_RULES):
+  """Read an export into first names, last names, index and score matrix."""
+  with open(file_name) as f:
+    reader = csv.reader(f)
+    index = grade_report.index_headers(next(reader), rules)
+    rows = [row for row in reader if row]
+
+  firsts = []
+  for row in rows:
+    first = row[index['first']]
+    match = grade_report.NICKNAME.search(first)
+    firsts.append(match.group()[1: -1] if match else first)
+  lasts = [row[index['last']] for row in rows]
+
+  columns = [a.column for a in index['assignments']]
+  if len(columns) > 1:
+    pick = operator.itemgetter(*columns)
+  else:
+    pick = lambda row: [row[c] for c in columns]
+  lookup = ScoreCache().__getitem__
+  scores = np.array([list(map(lookup, pick(row))) for row in rows],
+                    dtype=np.float64).reshape(len(rows), len(columns))
+  return firsts, lasts, index, scores
+
+
+def period_grades(index, scores):
+  """Return {period: grades} arrays, NaN where a category has no points."""
+  rules = index['rules']
+  pairs = [(period.name, category) for period in rules['periods']
+           for category in rules['categories']]
+  assignments = index['assignments']
+  selector = np.zeros((len(assignments), len(pairs)))
+  for i, assignment in enumerate(assignments):
+    for period in assignment.periods:
+      selector[i, pairs.index((period, assignment.category))] = 1
+  points = np.array([a.points for a in assignments], dtype=np.float64)
+
+  graded = ~np.isnan(scores)
+  student_scores = np.where(graded, scores, 0) @ selector
+  total_points = graded.astype(np.float64) @ (selector * points[:, None])
+
+  grades = {}
+  with np.errstate(divide='ignore', invalid='ignore'):
+    for period in rules['periods']:
+      # same operation order as grade_report so results match bit for bit
+      grade = 0
+      for category, weight in rules['categories'].items():
+        j = pairs.index((period.name, category))
+        grade = grade + weight * student_scores[:, j] / total_points[:, j]
+      grade = grade * 100
+      ok = np.all(total_points[:, [pairs.index((period.name, c))
+                                   for c in rules['categories']]] > 0, axis=1)
+      grades[period.name] = np.where(ok, grade, np.nan)
+  return grades
+
+
+def report(file_name, rules=grade_report.DEFAULT_RULES):
+  """Print the same report as grade_report.main."""
+  print('-' * 80)
+  firsts, lasts, index, scores = load_scores(file_name, rules)
+  grades = period_grades(index, scores)
+  for i, (first, last) in enumerate(zip(firsts, lasts)):
+    if any(np.isnan(g[i]) for g in grades.values()):
+      print('Not have enough assignments in schoology for {}!'.format(first))
+      continue
+    line = '{:10.10} {:10.10}'.format(first, last)
+    for name, g in grades.items():
+      line += '    {}: {:6.2f}'.format(name, g[i])
+    print(line)
+  print('-' * 80)
+
+
+def make_synthetic_export(file_name, n_students, n_assignments, seed=0):
+  """Write a random export shaped like a Schoology gradebook download."""
+  rng = random.Random(seed)
+  headers = ['First Name', 'Last Name', 'Unique User ID']
+  points = []
+  for k in range(n_assignments):
+    date = dt.date(2019, 11, 1) + dt.timedelta(days=rng.randint(0, 200))
+    points.append(rng.choice([10, 20, 50, 100]))
+    category = rng.choice('FSH')
+    headers.append(f'Assignment {k} (Max Pts: {points[-1]}, '
+                   f'Due Date: {date:%m/%d/%y}, Grading Category: {category})')
+  with open(file_name, 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(headers)
+    for i in range(n_students):
+      row = [f'First{i}', f'Last{i}', str(i)]
+      for p in points:
+        r = rng.random()
+        row.append('' if r < 0.05 else 'Excused' if r < 0.08
+                   else str(rng.randint(0, p)))
+      writer.writerow(row)
+
+
+def benchmark(n_students=10_000, n_assignments=1_000):
+  """Time per-row and matrix reports on a synthetic export and compare them."""
+  with tempfile.TemporaryDirectory() as tmp:
+    file_name = os.path.join(tmp, 'export.csv')
+    make_synthetic_export(file_name, n_students, n_assignments)
+    outputs = []
+    for name, run in [('per-row', grade_report.main), ('matrix', report)]:
+      out = io.StringIO()
+      start = time.perf_counter()
+      with contextlib.redirect_stdout(out):
+        run(file_name)
+      print(f'{name}: {time.perf_counter() - start:.2f} sec')
+      outputs.append(out.getvalue())
+  print('identical output:', outputs[0] == outputs[1])
+
+
+if __name__ == '__main__':
+  if sys.argv[-1] == '--benchmark':
+    benchmark()
+  else:
+    report(sys.argv[-1], grade_report.rules_from_argv(sys.argv))
@@ -1,20 +1,85 @@
 import csv
 import sys
 import re
+import json
+import bisect
+import collections
 import datetime as dt
 
 
-def get_meta_data(header):
-  """Get meta-data as dictionary for assignment-type headers."""
-  match = re.search(r'Max Pts: \d+,', header)
+MAX_POINTS = re.compile(r'Max Pts: \d+,')
+DUE_DATE = re.compile(r'Due Date: \d+/\d+/\d+')
+CATEGORY = re.compile(r'Grading Category: \w')
+NICKNAME = re.compile(r'\((.*?)\)')
+
+# one row per assignment that counts toward at least one grading period
+Assignment = collections.namedtuple(
+    'Assignment', ['column', 'points', 'date', 'category', 'periods'])
+
+# a reporting window of due dates, start inclusive and end exclusive
+Period = collections.namedtuple('Period', ['name', 'start', 'end'])
+
+# grading category letter -> weight, and the reporting windows
+DEFAULT_RULES = {
+    'categories': {'F': 0.4, 'S': 0.6},
+    'periods': [Period('Q3', dt.date(2020, 1, 2), dt.date(2020, 3, 15)),
+                Period('Q4', dt.date(2020, 3, 15), dt.date.max)],
+}
+
+
+def load_rules(file_name):
+  """Load grading rules from json.
+
+  For example:
+  {"categories": {"F": 0.4, "S": 0.6},
+   "periods": [{"name": "Q3", "start": "2020-01-02", "end": "2020-03-15"},
+               {"name": "S2", "start": "2020-01-02"}]}
+  A missing end means the period never ends.
+  """
+  with open(file_name) as f:
+    data = json.load(f)
+  periods = []
+  for period in data['periods']:
+    end = period.get('end')
+    periods.append(Period(period['name'],
+                          dt.date.fromisoformat(period['start']),
+                          dt.date.fromisoformat(end) if end else dt.date.max))
+  return {'categories': data['categories'], 'periods': periods}
+
+
+def rules_from_argv(argv):
+  """Return rules from `--rules file.json` on the command line, or the default."""
+  if '--rules' in argv[:-1]:
+    return load_rules(argv[argv.index('--rules') + 1])
+  return DEFAULT_RULES
+
+
+def period_index(periods):
+  """Return sorted boundary dates and the period names covering each interval.
+
+  A due date falls in interval `bisect_right(boundaries, date) - 1`.
+  """
+  boundaries = sorted({p.start for p in periods} | {p.end for p in periods})
+  covering = [tuple(p.name for p in periods if p.start <= start < p.end)
+              for start in boundaries]
+  return boundaries, covering
+
+
+def get_meta_data(header, bad_assignments):
+  """Get meta-data as dictionary for assignment-type headers.
+
+  Headers with broken meta-data are reported once and collected in
+  `bad_assignments`.
+  """
+  match = MAX_POINTS.search(header)
   if match is None:
     return None
 
   try:
     points = int(match.group()[9:-1])
-    match = re.search(r'Due Date: \d+/\d+/\d+', header)
+    match = DUE_DATE.search(header)
     date = dt.datetime.strptime(match.group()[10:], '%m/%d/%y').date()
-    match = re.search(r'Grading Category: \w', header)
+    match = CATEGORY.search(header)
     category = match.group()[18]
     return {'points': points, 'date': date, 'category': category}
   except AttributeError:
@@ -25,54 +90,102 @@ def get_meta_data(header):
       print('Perhaps due-date is missing?!')
 
 
-def analyze_student(student_row):
-  """Get student grades for Q3 and Q4."""
-  global headers # pylint: disable=global-statement
+def index_headers(headers, rules=DEFAULT_RULES):
+  """Parse every header once into name columns and counted assignments."""
+  boundaries, covering = period_index(rules['periods'])
+  assignments = []
+  bad_assignments = []
+  for column, header in enumerate(headers):
+    meta = get_meta_data(header, bad_assignments)
+    if meta and meta['category'] in rules['categories']:
+      i = bisect.bisect_right(boundaries, meta['date']) - 1
+      periods = covering[i] if i >= 0 else ()
+      if periods:
+        assignments.append(Assignment(column, meta['points'], meta['date'],
+                                      meta['category'], periods))
+  user_id = headers.index('Unique User ID') if 'Unique User ID' in headers else None
+  return {'first': headers.index('First Name'),
+          'last': headers.index('Last Name'),
+          'id': user_id,
+          'assignments': assignments,
+          'bad_assignments': bad_assignments,
+          'rules': rules}
+
 
-  first = student_row['First Name']
-  match = re.search(r'\((.*?)\)', first)
+def grade_student(student_row, index):
+  """Return a dictionary of student names, id and a grade for each period.
+
+  A period's grade is None if some category has no graded points in it.
+  """
+  first = student_row[index['first']]
+  match = NICKNAME.search(first)
   if match:
     first = match.group()[1: -1]
-  last = student_row['Last Name']
-
-  student_scores = {'F3': 0, 'S3': 0, 'F4': 0, 'S4': 0}
-  total_points = {'F3': 0, 'S3': 0, 'F4': 0, 'S4': 0}
-
-  for header in headers:
-    meta = get_meta_data(header)
-    if meta and meta['category'] in ['F', 'S'] and meta['date'] > dt.date(2020, 1, 1):
-      key = meta['category']
-      if meta['date'] < dt.date(2020, 3, 15):
-        key += '3'
-      else:
-        key += '4'
-
-      score = student_row[header]
-      try:
-        student_scores[key] += int(score)
-        total_points[key] += meta['points']
-      except ValueError:  # student Except or no grade entered
-        pass
+  last = student_row[index['last']]
+  user_id = student_row[index['id']] if index['id'] is not None else None
 
-  try:
-    q3 = (0.4 * student_scores['F3'] / total_points['F3'] + \
-        0.6 * student_scores['S3'] / total_points['S3']) * 100
-    q4 = (0.4 * student_scores['F4'] / total_points['F4'] + \
-        0.6 * student_scores['S4'] / total_points['S4']) * 100
-  except ZeroDivisionError:
-    print('Not have enough assignments in schoology for {}!'.format(first))
+  student_scores = collections.defaultdict(int)
+  total_points = collections.defaultdict(int)
+
+  for assignment in index['assignments']:
+    score = student_row[assignment.column]
+    try:
+      score = int(score)
+    except ValueError:  # student Except or no grade entered
+      continue
+    for period in assignment.periods:
+      student_scores[period, assignment.category] += score
+      total_points[period, assignment.category] += assignment.points
+
+  rules = index['rules']
+  periods = {}
+  for period in rules['periods']:
+    try:
+      periods[period.name] = sum(
+          weight * student_scores[period.name, category] /
+          total_points[period.name, category]
+          for category, weight in rules['categories'].items()) * 100
+    except ZeroDivisionError:
+      periods[period.name] = None
+  return {'first': first, 'last': last, 'id': user_id, 'periods': periods}
+
+
+def analyze_student(student_row, index):
+  """Print student grades for every grading period."""
+  grades = grade_student(student_row, index)
+  if None in grades['periods'].values():
+    print('Not have enough assignments in schoology for {}!'.format(grades['first']))
     return
+  line = '{:10.10} {:10.10}'.format(grades['first'], grades['last'])
+  for name, grade in grades['periods'].items():
+    line += '    {}: {:6.2f}'.format(name, grade)
+  print(line)
+
+
+def grade_file(file_name, rules=DEFAULT_RULES):
+  """Stream the rows of one export, yielding each student's grades."""
+  with open(file_name) as f:
+    reader = csv.reader(f)
+    index = index_headers(next(reader), rules)
+    for student in reader:
+      # skip blank lines, such as a trailing one, as DictReader did
+      if not student:
+        continue
+      yield grade_student(student, index)
+
 
-  print('{:10.10} {:10.10}    Q3: {:6.2f}    Q4: {:6.2f}'.format(first, last, q3, q4))
+def main(file_name, rules=DEFAULT_RULES):
+  """Open the csv and print the results."""
+  with open(file_name) as f:
+    reader = csv.reader(f)
+    print('-' * 80)
+    header_index = index_headers(next(reader), rules)
+    for student in reader:
+      if not student:
+        continue
+      analyze_student(student, header_index)
+    print('-' * 80)
 
 
-# Opening the csv and printing the results.
-file_name = sys.argv[-1]
-bad_assignments = []
-with open(file_name) as f:
-  reader = csv.DictReader(f)
-  headers = reader.fieldnames
-  print('-' * 80)
-  for student in reader:
-    analyze_student(student)
-  print('-' * 80)
+if __name__ == '__main__':
+  main(sys.argv[-1], rules_from_argv(sys.argv))
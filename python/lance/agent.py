@@ -1,7 +1,8 @@
 """A tf agent based on: https://www.tensorflow.org/agents/tutorials/1_dqn_tutorial"""
 
 import tensorflow as tf
-from environment import LanceEnvironment
+from environment import LanceEnvironment, BatchLanceEnvironment
+from parallel_environment import ParallelLanceEnvironment
 from tf_agents.utils import common
 from tf_agents.metrics import tf_metrics
 from tf_agents.replay_buffers import tf_uniform_replay_buffer
@@ -24,10 +25,23 @@ fc_layer_params = (100,)
 batch_size = 1
 learning_rate = 1e-3
 log_interval = 1
+# number of games stepped together by the training environment
+num_parallel_games = 1
+# collect in worker processes; set False to debug with the in-process env
+use_collect_workers = False
+num_collect_workers = 4
+# games stepped by each collect worker per round
+games_per_collect_worker = 8
 
 
 # environment
-train_py_env = LanceEnvironment()
+if use_collect_workers:
+  train_py_env = ParallelLanceEnvironment(
+      num_workers=num_collect_workers, games_per_worker=games_per_collect_worker)
+elif num_parallel_games > 1:
+  train_py_env = BatchLanceEnvironment(batch_size=num_parallel_games)
+else:
+  train_py_env = LanceEnvironment()
 eval_py_env = LanceEnvironment()
 train_env = tf_py_environment.TFPyEnvironment(train_py_env)
 eval_env = tf_py_environment.TFPyEnvironment(eval_py_env)
@@ -1,6 +1,7 @@
 """A tf environment based on: https://www.tensorflow.org/agents/tutorials/2_environments_tutorial"""
 
 import os
+import time
 from tqdm import tqdm
 import numpy as np
 import tensorflow as tf
@@ -9,18 +10,24 @@ from tf_agents.specs import array_spec
 from tf_agents.environments import utils
 from tf_agents.environments import tf_py_environment
 from tf_agents.environments import py_environment
+from game import GAME_DIMENSION, MOVES, LanceGame
 
 # suppress warnings
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 
-GAME_DIMENSION = 6
+class LanceEnvironment(LanceGame, py_environment.PyEnvironment):
+  """Game environment derived from PyEnvironment.
 
+  The observation dtype (e.g. np.uint8 or bool for a compact replay buffer) is
+  set by `observation_dtype` and reported through `observation_spec`. With
+  `reuse_observation=True` the environment owns a single observation buffer
+  and patches only the cells that changed on each step; the returned
+  observation is then overwritten by the next step, so callers that keep
+  observations around (other than TFPyEnvironment, which copies) should copy.
+  """
 
-class LanceEnvironment(py_environment.PyEnvironment):
-  """Game environment derived from PyEnvironment."""
-
-  def __init__(self):
+  def __init__(self, observation_dtype=np.int32, reuse_observation=False):
     super().__init__()
 
     # four possible moves
@@ -29,42 +36,27 @@ class LanceEnvironment(py_environment.PyEnvironment):
 
     # 3 arrays representing player position, food position, portal positions
     self._observation_spec = array_spec.BoundedArraySpec(
-        shape=(3, GAME_DIMENSION, GAME_DIMENSION), dtype=np.int32, minimum=0,
-        maximum=1, name='observation')
+        shape=(3, GAME_DIMENSION, GAME_DIMENSION), dtype=observation_dtype,
+        minimum=0, maximum=1, name='observation')
 
-    # initial state; filling with some empty values to keep linter happy
-    self.player = self.player = GAME_DIMENSION // 2, GAME_DIMENSION // 2
-    self.food = 0, 0
-    self.portal1 = 0, 0
-    self.portal2 = 0, 0
-    self.new_food_and_portals()
-
-    self.score = 0
-    self._episode_ended = False
-
-  @classmethod
-  def rand_tuple(cls):
-    """Return a random tuple representing a position in the game."""
-    return np.random.randint(GAME_DIMENSION), np.random.randint(GAME_DIMENSION)
-
-  def new_food_and_portals(self):
-    """Reset food and portals with random distinct game positions."""
-    self.food = self.rand_tuple()
-    self.portal1 = self.rand_tuple()
-    while self.portal1 == self.food:
-      self.portal1 = self.rand_tuple()
-    self.portal2 = self.rand_tuple()
-    while self.portal2 in [self.food, self.portal1]:
-      self.portal2 = self.rand_tuple()
+    self._observation = None
+    if reuse_observation:
+      self._observation = self._state
 
   @property
   def _state(self):
-    state = np.zeros((3, GAME_DIMENSION, GAME_DIMENSION), dtype=np.int32)
-    state[0, self.player[0], self.player[1]] = 1
-    state[1, self.food[0], self.food[1]] = 1
-    state[2, self.portal1[0], self.portal1[1]] = 1
-    state[2, self.portal2[0], self.portal2[1]] = 1
-    return state
+    if self._observation is not None:
+      return self._observation
+    return self.observation(self._observation_spec.dtype)
+
+  def _patch_observation(self, old_cells):
+    """Clear the previously occupied cells of the owned buffer and mark the new."""
+    if self._observation is None:
+      return
+    for cell in old_cells:
+      self._observation[cell] = 0
+    for cell in self._cells():
+      self._observation[cell] = 1
 
   def action_spec(self):
     return self._action_spec
@@ -73,67 +65,146 @@ class LanceEnvironment(py_environment.PyEnvironment):
     return self._observation_spec
 
   def _reset(self):
-    self.player = self.player = GAME_DIMENSION // 2, GAME_DIMENSION // 2
-    self.new_food_and_portals()
-    self.score = 0
-    self._episode_ended = False
+    old_cells = self._cells()
+    self.new_game()
+    self._patch_observation(old_cells)
     return ts.restart(self._state)
 
   def _step(self, action):
     if self._episode_ended:
       self._reset()
-
-    if action == 0:  # go north
-      self.player = self.player[0], self.player[1] + 1
-    elif action == 1:  # east
-      self.player = self.player[0] + 1, self.player[1]
-    elif action == 2:  # south
-      self.player = self.player[0], self.player[1] - 1
-    elif action == 3:
-      self.player = self.player[0] - 1, self.player[1]
-    else:
-      raise ValueError('`action` should be 0, 1, 2, or 3.')
-
-    self.collide_with_wall()
-    self.eat_food()
-    self.move_through_portal()
+    old_cells = self._cells()
+    self.move(action)
+    self._patch_observation(old_cells)
 
     if self._episode_ended:
       reward = self.score
       return ts.termination(self._state, reward)
     return ts.transition(self._state, reward=self.score, discount=1.0)
 
-  def collide_with_wall(self):
-    """Determine if player collides with wall then reset position to stay in array."""
-    if self.player[0] < 0:
-      self.player = 0, self.player[1]
-      self.score -= 10
-      self._episode_ended = True
-    elif self.player[0] >= GAME_DIMENSION:
-      self.player = GAME_DIMENSION - 1, self.player[1]
-      self.score -= 10
-      self._episode_ended = True
-    elif self.player[1] < 0:
-      self.player = self.player[0], 0
-      self.score -= 10
-      self._episode_ended = True
-    elif self.player[1] >= GAME_DIMENSION:
-      self.player = self.player[0], GAME_DIMENSION - 1
-      self.score -= 10
-      self._episode_ended = True
-
-  def eat_food(self):
-    """Eat then reset food and portals if player is touching food."""
-    if self.player == self.food:
-      self.score += 1
-      self.new_food_and_portals()
-
-  def move_through_portal(self):
-    """If player is touching portal door, move through portal."""
-    if self.player == self.portal1:
-      self.player = self.portal2
-    elif self.player == self.portal2:
-      self.player = self.portal1
+
+class BatchLanceEnvironment(py_environment.PyEnvironment):
+  """Batched game environment stepping `batch_size` independent games at once.
+
+  Positions are stored as integer arrays of shape (batch_size, 2). A game that
+  ended on the previous step is reset on the next call to `step` and emits a
+  `FIRST` time step, ignoring its action, as tf-agents expects of batched
+  environments.
+  """
+
+  def __init__(self, batch_size=32):
+    super().__init__()
+    self._batch_size = batch_size
+
+    # same specs as LanceEnvironment; the batch dimension is implicit
+    self._action_spec = array_spec.BoundedArraySpec(
+        shape=(), dtype=np.int32, minimum=0, maximum=3, name='action')
+    self._observation_spec = array_spec.BoundedArraySpec(
+        shape=(3, GAME_DIMENSION, GAME_DIMENSION), dtype=np.int32, minimum=0,
+        maximum=1, name='observation')
+
+    self.player = np.full((batch_size, 2), GAME_DIMENSION // 2, dtype=np.int32)
+    self.food = np.zeros((batch_size, 2), dtype=np.int32)
+    self.portal1 = np.zeros((batch_size, 2), dtype=np.int32)
+    self.portal2 = np.zeros((batch_size, 2), dtype=np.int32)
+    self.score = np.zeros(batch_size, dtype=np.float32)
+    self._episode_ended = np.zeros(batch_size, dtype=bool)
+    self.new_food_and_portals(np.ones(batch_size, dtype=bool))
+
+  @property
+  def batched(self):
+    return True
+
+  @property
+  def batch_size(self):
+    return self._batch_size
+
+  def action_spec(self):
+    return self._action_spec
+
+  def observation_spec(self):
+    return self._observation_spec
+
+  def new_food_and_portals(self, mask):
+    """Reset food and portals with random distinct positions in masked games."""
+    n = np.count_nonzero(mask)
+    cells = GAME_DIMENSION * GAME_DIMENSION
+    # draw three distinct cells by skipping over the cells already taken
+    food = np.random.randint(cells, size=n)
+    portal1 = np.random.randint(cells - 1, size=n)
+    portal1 += portal1 >= food
+    portal2 = np.random.randint(cells - 2, size=n)
+    low, high = np.minimum(food, portal1), np.maximum(food, portal1)
+    portal2 += portal2 >= low
+    portal2 += portal2 >= high
+    self.food[mask] = np.stack(np.divmod(food, GAME_DIMENSION), axis=1)
+    self.portal1[mask] = np.stack(np.divmod(portal1, GAME_DIMENSION), axis=1)
+    self.portal2[mask] = np.stack(np.divmod(portal2, GAME_DIMENSION), axis=1)
+
+  def reset_games(self, mask):
+    """Restart the masked games."""
+    self.player[mask] = GAME_DIMENSION // 2
+    self.new_food_and_portals(mask)
+    self.score[mask] = 0
+    self._episode_ended[mask] = False
+
+  @property
+  def _state(self):
+    state = np.zeros((self._batch_size, 3, GAME_DIMENSION, GAME_DIMENSION),
+                     dtype=np.int32)
+    games = np.arange(self._batch_size)
+    state[games, 0, self.player[:, 0], self.player[:, 1]] = 1
+    state[games, 1, self.food[:, 0], self.food[:, 1]] = 1
+    state[games, 2, self.portal1[:, 0], self.portal1[:, 1]] = 1
+    state[games, 2, self.portal2[:, 0], self.portal2[:, 1]] = 1
+    return state
+
+  def _reset(self):
+    self.reset_games(np.ones(self._batch_size, dtype=bool))
+    return ts.restart(self._state, batch_size=self._batch_size)
+
+  def _step(self, action):
+    action = np.asarray(action).reshape(self._batch_size)
+    if np.any((action < 0) | (action > 3)):
+      raise ValueError('`action` should be 0, 1, 2, or 3.')
+
+    # games that ended last step restart instead of moving
+    restarted = self._episode_ended.copy()
+    self.reset_games(restarted)
+    playing = ~restarted
+
+    self.player[playing] += MOVES[action[playing]]
+    self.collide_with_wall(playing)
+    self.eat_food(playing)
+    self.move_through_portal(playing)
+
+    step_type = np.where(self._episode_ended, ts.StepType.LAST,
+                         ts.StepType.MID).astype(np.int32)
+    step_type[restarted] = ts.StepType.FIRST
+    reward = np.where(restarted, 0, self.score).astype(np.float32)
+    discount = np.where(self._episode_ended, 0, 1).astype(np.float32)
+    return ts.TimeStep(step_type, reward, discount, self._state)
+
+  def collide_with_wall(self, mask):
+    """End masked games whose player left the board and clip it back inside."""
+    hit = mask & np.any((self.player < 0) | (self.player >= GAME_DIMENSION),
+                        axis=1)
+    np.clip(self.player, 0, GAME_DIMENSION - 1, out=self.player)
+    self.score[hit] -= 10
+    self._episode_ended[hit] = True
+
+  def eat_food(self, mask):
+    """Eat then reset food and portals in masked games touching food."""
+    eat = mask & np.all(self.player == self.food, axis=1)
+    self.score[eat] += 1
+    self.new_food_and_portals(eat)
+
+  def move_through_portal(self, mask):
+    """Move masked players standing on a portal door through the portal."""
+    at1 = mask & np.all(self.player == self.portal1, axis=1)
+    at2 = mask & ~at1 & np.all(self.player == self.portal2, axis=1)
+    self.player[at1] = self.portal2[at1]
+    self.player[at2] = self.portal1[at2]
 
 
 def test_environment():
@@ -170,6 +241,54 @@ def test_episodes(num_episodes=1000):
   print('avg_length', avg_length, 'avg_reward:', avg_reward)
 
 
+def test_observation_buffer(num_steps=1000):
+  """Test that the patched observation buffer matches a freshly built state."""
+  environment = LanceEnvironment(observation_dtype=np.uint8,
+                                 reuse_observation=True)
+  utils.validate_py_environment(environment, episodes=5)
+  environment.reset()
+  for action in np.random.randint(4, size=num_steps):
+    observation = environment.step(action).observation
+    buffer, environment._observation = environment._observation, None
+    assert np.array_equal(observation, environment._state)
+    environment._observation = buffer
+  print('Test successful.')
+
+
+def test_batch_environment():
+  """Test batched environment using built-in validate tool."""
+  environment = BatchLanceEnvironment(batch_size=8)
+  utils.validate_py_environment(environment, episodes=5)
+  print('Test successful.')
+
+
+def benchmark_batch(batch_size=256, num_steps=100_000):
+  """Compare steps per second of the scalar and batched environments."""
+  env = LanceEnvironment()
+  env.reset()
+  actions = np.random.randint(4, size=num_steps).astype(np.int32)
+  start = time.perf_counter()
+  for action in actions:
+    env.step(action)
+  scalar_rate = num_steps / (time.perf_counter() - start)
+
+  batch_env = BatchLanceEnvironment(batch_size)
+  batch_env.reset()
+  num_batches = max(1, num_steps // batch_size)
+  actions = np.random.randint(4, size=(num_batches, batch_size)).astype(np.int32)
+  start = time.perf_counter()
+  for action in actions:
+    batch_env.step(action)
+  batch_rate = num_batches * batch_size / (time.perf_counter() - start)
+
+  print(f'scalar: {scalar_rate:,.0f} steps/sec')
+  print(f'batch of {batch_size}: {batch_rate:,.0f} steps/sec '
+        f'({batch_rate / scalar_rate:.1f}x)')
+
+
 if __name__ == '__main__':
   test_environment()
+  test_observation_buffer()
+  test_batch_environment()
   test_episodes()
+  benchmark_batch()
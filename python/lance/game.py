@@ -0,0 +1,109 @@
+"""Lance game rules, free of any tensorflow dependency."""
+
+import numpy as np
+
+
+GAME_DIMENSION = 6
+
+# player displacement for each action: north, east, south, west
+MOVES = np.array([[0, 1], [1, 0], [0, -1], [-1, 0]], dtype=np.int32)
+
+
+class LanceGame:
+  """Player, food and portals on a GAME_DIMENSION x GAME_DIMENSION board."""
+
+  def __init__(self):
+    super().__init__()
+
+    # initial state; filling with some empty values to keep linter happy
+    self.player = self.player = GAME_DIMENSION // 2, GAME_DIMENSION // 2
+    self.food = 0, 0
+    self.portal1 = 0, 0
+    self.portal2 = 0, 0
+    self.new_food_and_portals()
+
+    self.score = 0
+    self._episode_ended = False
+
+  @classmethod
+  def rand_tuple(cls):
+    """Return a random tuple representing a position in the game."""
+    return np.random.randint(GAME_DIMENSION), np.random.randint(GAME_DIMENSION)
+
+  def new_food_and_portals(self):
+    """Reset food and portals with random distinct game positions."""
+    self.food = self.rand_tuple()
+    self.portal1 = self.rand_tuple()
+    while self.portal1 == self.food:
+      self.portal1 = self.rand_tuple()
+    self.portal2 = self.rand_tuple()
+    while self.portal2 in [self.food, self.portal1]:
+      self.portal2 = self.rand_tuple()
+
+  def new_game(self):
+    """Put the player back in the middle with fresh food and portals."""
+    self.player = self.player = GAME_DIMENSION // 2, GAME_DIMENSION // 2
+    self.new_food_and_portals()
+    self.score = 0
+    self._episode_ended = False
+
+  def _cells(self):
+    """Return the (channel, x, y) index of each occupied observation cell."""
+    return [(0, *self.player), (1, *self.food),
+            (2, *self.portal1), (2, *self.portal2)]
+
+  def observation(self, dtype=np.int32):
+    """Return 3 arrays representing player, food and portal positions."""
+    state = np.zeros((3, GAME_DIMENSION, GAME_DIMENSION), dtype=dtype)
+    for cell in self._cells():
+      state[cell] = 1
+    return state
+
+  def move(self, action):
+    """Move the player one cell then apply walls, food and portals."""
+    if action == 0:  # go north
+      self.player = self.player[0], self.player[1] + 1
+    elif action == 1:  # east
+      self.player = self.player[0] + 1, self.player[1]
+    elif action == 2:  # south
+      self.player = self.player[0], self.player[1] - 1
+    elif action == 3:
+      self.player = self.player[0] - 1, self.player[1]
+    else:
+      raise ValueError('`action` should be 0, 1, 2, or 3.')
+
+    self.collide_with_wall()
+    self.eat_food()
+    self.move_through_portal()
+
+  def collide_with_wall(self):
+    """Determine if player collides with wall then reset position to stay in array."""
+    if self.player[0] < 0:
+      self.player = 0, self.player[1]
+      self.score -= 10
+      self._episode_ended = True
+    elif self.player[0] >= GAME_DIMENSION:
+      self.player = GAME_DIMENSION - 1, self.player[1]
+      self.score -= 10
+      self._episode_ended = True
+    elif self.player[1] < 0:
+      self.player = self.player[0], 0
+      self.score -= 10
+      self._episode_ended = True
+    elif self.player[1] >= GAME_DIMENSION:
+      self.player = self.player[0], GAME_DIMENSION - 1
+      self.score -= 10
+      self._episode_ended = True
+
+  def eat_food(self):
+    """Eat then reset food and portals if player is touching food."""
+    if self.player == self.food:
+      self.score += 1
+      self.new_food_and_portals()
+
+  def move_through_portal(self):
+    """If player is touching portal door, move through portal."""
+    if self.player == self.portal1:
+      self.player = self.portal2
+    elif self.player == self.portal2:
+      self.player = self.portal1
@@ -1,27 +1,31 @@
-import pygame
+import os
+import sys
+import time
 from random import randint
-pygame.init()
+import pygame
+
+# the shared game loop lives with the other pygame examples
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'pygame_examples'))
+import game_loop  # pylint: disable=wrong-import-position
 
 
 CELL_SIZE = 20
 DIMENSION = 30
-screen = pygame.display.set_mode([DIMENSION * CELL_SIZE, DIMENSION * CELL_SIZE])
-pygame.display.set_caption('Hello World')
-
-
-clock = pygame.time.Clock()
-
+# game logic ticks per second
+TICK_RATE = 5
 
 
 class Player:
-    def __init__(self):
-        self.x = DIMENSION // 2
-        self.y = DIMENSION // 2
+    def __init__(self, dimension=DIMENSION):
+        self.dimension = dimension
+        self.x = dimension // 2
+        self.y = dimension // 2
         self.dx = 1
         self.dy = 0
         self.color = (255,0,0)
         self.score = 0
-        
+
     def apply_key(self, key):
         if key == pygame.K_LEFT:
             self.dx = -1
@@ -35,63 +39,130 @@ class Player:
         elif key == pygame.K_DOWN:
             self.dx = 0
             self.dy = 1
-            
+
     def move(self):
         self.x += self.dx
         self.y += self.dy
-        
+
     def collision(self):
-        if (self.x < 0 or self.x >= DIMENSION or self.y < 0 or self.y >= DIMENSION):
-            self.__init__()
-        
+        if (self.x < 0 or self.x >= self.dimension or self.y < 0 or self.y >= self.dimension):
+            self.__init__(self.dimension)
+
     def eat(self, food):
         if self.x == food.x and self.y == food.y:
             self.score += 1
-            food.__init__()
+            food.__init__(food.dimension)
 
-    
-    def draw(self):
-        pygame.draw.rect(screen, self.color, (self.x * CELL_SIZE, self.y * CELL_SIZE, CELL_SIZE, CELL_SIZE))
+
+    def draw(self, screen):
+        return pygame.draw.rect(screen, self.color, (self.x * CELL_SIZE, self.y * CELL_SIZE, CELL_SIZE, CELL_SIZE))
 
 class Food:
-    def __init__(self):
-        self.x = randint(0, DIMENSION - 1)
-        self.y = randint(0, DIMENSION - 1)
+    def __init__(self, dimension=DIMENSION):
+        self.dimension = dimension
+        self.x = randint(0, dimension - 1)
+        self.y = randint(0, dimension - 1)
         self.color = (0,255,0)
-        
-    def draw(self):
-        pygame.draw.rect(screen, self.color, (self.x * CELL_SIZE, self.y * CELL_SIZE, CELL_SIZE, CELL_SIZE))
-        
+
+    def draw(self, screen):
+        return pygame.draw.rect(screen, self.color, (self.x * CELL_SIZE, self.y * CELL_SIZE, CELL_SIZE, CELL_SIZE))
+
 class Portal:
     def __init__(self):
-        self.x1 = randint(0,0, DIMENSION - 1)
-        self.y1 = randint(0,0, DIMENSION - 1)
-        self.x2 = randint(0,0, DIMENSION - 1)
-        self.y2 = randint(0,0, DIMENSION - 1)
-
-        
-p = Player()
-
-f = Food()
-  
-
-running = True
-while running:
-    clock.tick(5)
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.KEYDOWN:
+        self.x1 = randint(0, DIMENSION - 1)
+        self.y1 = randint(0, DIMENSION - 1)
+        self.x2 = randint(0, DIMENSION - 1)
+        self.y2 = randint(0, DIMENSION - 1)
+
+
+class Game:
+    """Game rules only; nothing here needs a display."""
+    def __init__(self, dimension=DIMENSION):
+        self.player = Player(dimension)
+        self.food = Food(dimension)
+
+    def step(self):
+        self.player.move()
+        self.player.collision()
+        self.player.eat(self.food)
+
+    def draw(self, screen):
+        """Draw the sprites and return the rects they cover."""
+        return [self.player.draw(screen), self.food.draw(screen)]
+
+
+def main(stats_csv=None):
+    pygame.init()
+    screen = pygame.display.set_mode([DIMENSION * CELL_SIZE, DIMENSION * CELL_SIZE])
+    pygame.display.set_caption('Hello World')
+
+    game = Game()
+
+    def handle_event(event):
+        if event.type == pygame.KEYDOWN:
             print(event.key)
-            p.apply_key(event.key)
-            
-    screen.fill((255, 255, 255))
-    p.move()
-    p.collision()
-    p.eat(f)
-    p.draw()
-    f.draw()
-    # updates pygame display
-    pygame.display.flip()
-
-pygame.quit()
\ No newline at end of file
+            game.player.apply_key(event.key)
+
+    game_loop.run(screen, game.step, game.draw, handle_event,
+                  tick_rate=TICK_RATE, stats_csv=stats_csv, dirty_rects=True)
+    pygame.quit()
+
+
+def benchmark(num_ticks=1_000_000):
+    """Run the game logic without rendering and report ticks per second."""
+    game = Game()
+    start = time.perf_counter()
+    for _ in range(num_ticks):
+        game.step()
+    elapsed = time.perf_counter() - start
+    print(f'lance: {num_ticks / elapsed:,.0f} ticks/sec')
+
+
+def measure_rendering(dimensions=(DIMENSION, 100, 200), num_frames=200):
+    """Compare full fill-and-flip redraws with dirty-rect updates per frame.
+
+    Run this with a display, so that flip and update(rects) push pixels to a
+    real window. Without one, the dummy driver is used, where both are no-ops
+    and only the drawing is timed.
+    """
+    has_display = (not sys.platform.startswith('linux') or
+                   os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+    if not has_display:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.init()
+    driver = pygame.display.get_driver()
+    print(f'video driver: {driver}')
+    if driver in ('dummy', 'offscreen'):
+        print('  no display: flip and update are no-ops, only drawing is timed')
+    for dimension in dimensions:
+        screen = pygame.display.set_mode([dimension * CELL_SIZE, dimension * CELL_SIZE])
+        game = Game(dimension)
+
+        start = time.perf_counter()
+        for _ in range(num_frames):
+            game.step()
+            screen.fill((255, 255, 255))
+            game.draw(screen)
+            pygame.display.flip()
+        full = (time.perf_counter() - start) / num_frames * 1000
+
+        tracker = game_loop.DirtyRects()
+        screen.fill(tracker.background)
+        pygame.display.flip()
+        start = time.perf_counter()
+        for _ in range(num_frames):
+            game.step()
+            pygame.display.update(tracker.draw(screen, game.draw))
+        dirty = (time.perf_counter() - start) / num_frames * 1000
+
+        print(f'{dimension}x{dimension} board: full redraw {full:.3f} ms/frame, '
+              f'dirty rects {dirty:.3f} ms/frame')
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    if sys.argv[-1] == '--benchmark':
+        benchmark()
+        measure_rendering()
+    else:
+        main(game_loop.stats_path(sys.argv))
@@ -0,0 +1,207 @@
+"""A DQN agent for Lance written in plain numpy, mirroring agent.py without tensorflow.
+
+Importing this module only pulls in numpy, so short smoke runs and small CPU
+workers can start training immediately.
+"""
+
+import time
+import collections
+import numpy as np
+from game import GAME_DIMENSION, LanceGame
+from replay_memory import ReplayMemory, encode_state
+
+
+# hyperparameters; the first six match agent.py
+collect_steps_per_iteration = 100
+replay_buffer_capacity = 30
+fc_layer_params = (100,)
+batch_size = 1
+learning_rate = 1e-3
+log_interval = 1
+# DqnAgent defaults
+gamma = 1.0
+epsilon_greedy = 0.1
+target_update_period = 1
+# proportional prioritized replay
+prioritized_replay = False
+priority_alpha = 0.6
+priority_beta = 0.4
+
+OBSERVATION_SIZE = 3 * GAME_DIMENSION * GAME_DIMENSION
+NUM_ACTIONS = 4
+
+
+class QNetwork:
+  """Fully connected relu network mapping a flat observation to 4 Q-values.
+
+  Initialized like tf-agents' QNetwork: scaled normal hidden kernels and a
+  small uniform output layer with a -0.2 bias.
+  """
+
+  def __init__(self, layer_params=fc_layer_params, rng=None):
+    rng = np.random.default_rng() if rng is None else rng
+    sizes = (OBSERVATION_SIZE,) + tuple(layer_params)
+    self.params = []
+    for n_in, n_out in zip(sizes[:-1], sizes[1:]):
+      kernel = rng.normal(0, np.sqrt(2 / n_in), (n_in, n_out))
+      self.params += [kernel.astype(np.float32), np.zeros(n_out, np.float32)]
+    kernel = rng.uniform(-0.03, 0.03, (sizes[-1], NUM_ACTIONS))
+    self.params += [kernel.astype(np.float32),
+                    np.full(NUM_ACTIONS, -0.2, np.float32)]
+
+  def copy(self):
+    """Return a network with copies of these parameters."""
+    other = QNetwork.__new__(QNetwork)
+    other.params = [p.copy() for p in self.params]
+    return other
+
+  def forward(self, x):
+    """Return Q-values of a batch of observations and the layer inputs."""
+    activations = [x]
+    for i in range(0, len(self.params) - 2, 2):
+      x = np.maximum(x @ self.params[i] + self.params[i + 1], 0)
+      activations.append(x)
+    return x @ self.params[-2] + self.params[-1], activations
+
+  def __call__(self, x):
+    return self.forward(x)[0]
+
+  def gradients(self, activations, grad_q):
+    """Backpropagate the loss gradient with respect to the Q-values."""
+    grads = [None] * len(self.params)
+    grad = grad_q
+    for i in range(len(self.params) - 2, -1, -2):
+      x = activations[i // 2]
+      grads[i] = x.T @ grad
+      grads[i + 1] = grad.sum(axis=0)
+      if i:
+        grad = (grad @ self.params[i].T) * (x > 0)
+    return grads
+
+
+class Adam:
+  """Adam optimizer updating a list of arrays in place."""
+
+  def __init__(self, params, learning_rate=learning_rate, beta1=0.9,
+               beta2=0.999, epsilon=1e-7):
+    self.params = params
+    self.learning_rate = learning_rate
+    self.beta1, self.beta2, self.epsilon = beta1, beta2, epsilon
+    self.m = [np.zeros_like(p) for p in params]
+    self.v = [np.zeros_like(p) for p in params]
+    self.t = 0
+
+  def apply(self, grads):
+    """Take one optimization step."""
+    self.t += 1
+    lr = self.learning_rate * np.sqrt(1 - self.beta2 ** self.t) / \
+        (1 - self.beta1 ** self.t)
+    for p, g, m, v in zip(self.params, grads, self.m, self.v):
+      m += (1 - self.beta1) * (g - m)
+      v += (1 - self.beta2) * (g * g - v)
+      p -= lr * m / (np.sqrt(v) + self.epsilon)
+
+
+class NumpyDqnAgent:
+  """DQN with a target network and element-wise squared TD loss."""
+
+  def __init__(self, seed=None):
+    self.rng = np.random.default_rng(seed)
+    self.q_net = QNetwork(rng=self.rng)
+    self.target_q_net = self.q_net.copy()
+    self.optimizer = Adam(self.q_net.params)
+    self.train_step_counter = 0
+
+  def action(self, observation, epsilon=0.0):
+    """Return the greedy action, or a random one with probability epsilon."""
+    if self.rng.random() < epsilon:
+      return int(self.rng.integers(NUM_ACTIONS))
+    return int(np.argmax(self.q_net(observation[None])[0]))
+
+  def train(self, experience, weights=None):
+    """Update the Q-network on a batch of transitions.
+
+    Returns the (importance weighted) loss and the per-transition TD errors.
+    """
+    observations, actions, rewards, discounts, next_observations = experience
+    n = len(actions)
+    observations = observations.reshape(n, OBSERVATION_SIZE)
+    next_observations = next_observations.reshape(n, OBSERVATION_SIZE)
+    weights = np.ones(n, np.float32) if weights is None else weights
+    next_q = self.target_q_net(next_observations).max(axis=1)
+    targets = rewards + gamma * discounts * next_q
+
+    q, activations = self.q_net.forward(observations)
+    rows = np.arange(n)
+    errors = q[rows, actions] - targets
+    grad_q = np.zeros_like(q)
+    grad_q[rows, actions] = 2 * weights * errors / n
+    self.optimizer.apply(self.q_net.gradients(activations, grad_q))
+
+    self.train_step_counter += 1
+    if self.train_step_counter % target_update_period == 0:
+      self.target_q_net = self.q_net.copy()
+    return float(np.mean(weights * errors ** 2)), errors
+
+
+class Collector:
+  """Step one game with the agent's collect policy, tracking episode returns."""
+
+  def __init__(self, agent, replay_buffer, num_returns=10):
+    self.agent = agent
+    self.replay_buffer = replay_buffer
+    self.game = LanceGame()
+    self.episode_return = 0.0
+    # like tf_metrics.AverageReturnMetric, average the last few episodes
+    self.returns = collections.deque(maxlen=num_returns)
+
+  def run(self, num_steps=collect_steps_per_iteration):
+    """Collect num_steps transitions into the replay buffer."""
+    for _ in range(num_steps):
+      state = encode_state(self.game)
+      observation = self.game.observation(np.float32).ravel()
+      action = self.agent.action(observation, epsilon_greedy)
+      self.game.move(action)
+      reward = self.game.score
+      discount = 0 if self.game._episode_ended else 1
+      self.replay_buffer.add(state, action, reward, discount,
+                             encode_state(self.game))
+      self.episode_return += reward
+      if self.game._episode_ended:
+        self.returns.append(self.episode_return)
+        self.episode_return = 0.0
+        self.game.new_game()
+
+  def average_return(self):
+    """Return the mean of the recent episode returns."""
+    return float(np.mean(self.returns)) if self.returns else 0.0
+
+
+def run(num_iterations=1000, seed=None):
+  """Train from scratch, logging loss and average return."""
+  start = time.perf_counter()
+  agent = NumpyDqnAgent(seed)
+  replay_buffer = ReplayMemory(replay_buffer_capacity,
+                               prioritized=prioritized_replay,
+                               alpha=priority_alpha, rng=agent.rng)
+  collector = Collector(agent, replay_buffer)
+  # initial data collection
+  collector.run()
+
+  for _ in range(num_iterations):
+    collector.run()
+    experience, indices, weights = replay_buffer.sample(batch_size,
+                                                        beta=priority_beta)
+    loss, errors = agent.train(experience, weights)
+    replay_buffer.update_priorities(indices, errors)
+    step = agent.train_step_counter
+    if step == 1:
+      print(f'first train step after {time.perf_counter() - start:.3f} sec')
+    if step % log_interval == 0:
+      print(f'step: {step} loss: {loss} '
+            f'average return: {collector.average_return()}')
+  return agent
+
+
+if __name__ == '__main__':
+  run()
@@ -0,0 +1,225 @@
+"""Batched environment stepping games in separate worker processes.
+
+Each worker owns a BatchLanceEnvironment of several games and steps all of
+them per round. Actions and time steps are exchanged through shared memory
+arrays; the only messages between processes are two barrier waits per round.
+A worker that raises aborts the barriers, and the parent re-raises its
+traceback instead of waiting forever.
+"""
+
+import sys
+import time
+import threading
+import traceback
+import multiprocessing as mp
+import numpy as np
+from tf_agents.trajectories import time_step as ts
+from tf_agents.environments import py_environment
+from environment import LanceEnvironment, BatchLanceEnvironment
+
+
+# commands written by the parent before releasing the workers
+STEP, RESET, CLOSE = 0, 1, 2
+
+
+def as_array(raw, shape, dtype):
+  """View a shared multiprocessing RawArray as a numpy array."""
+  return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+def run_worker(index, games_per_worker, shared, start, done, errors):
+  """Own games index * games_per_worker onwards and step them all per round.
+
+  Runs until the parent sends CLOSE. An exception is sent to the parent
+  through `errors` and breaks both barriers, so nobody keeps waiting.
+  """
+  games = slice(index * games_per_worker, (index + 1) * games_per_worker)
+  command, actions, step_types, rewards, discounts, observations = shared
+  try:
+    # forked workers inherit the parent's random state; draw different games
+    np.random.seed()
+    env = BatchLanceEnvironment(games_per_worker)
+    while True:
+      start.wait()
+      if command[0] == CLOSE:
+        break
+      if command[0] == RESET:
+        time_step = env.reset()
+      else:
+        time_step = env.step(actions[games])
+      step_types[games] = time_step.step_type
+      rewards[games] = time_step.reward
+      discounts[games] = time_step.discount
+      observations[games] = time_step.observation
+      done.wait()
+  except threading.BrokenBarrierError:
+    pass  # another worker failed or the parent gave up
+  except BaseException:  # pylint: disable=broad-except
+    errors.put((index, traceback.format_exc()))
+    start.abort()
+    done.abort()
+
+
+class ParallelLanceEnvironment(py_environment.PyEnvironment):
+  """Batched environment of `num_workers` processes of `games_per_worker` games.
+
+  The batch holds num_workers * games_per_worker games, worker i stepping
+  the i-th contiguous block of them. Workers are forked so that the training
+  script, which runs at module level, is not re-executed in each child.
+
+  A round that takes longer than `timeout` seconds, or a worker that raises
+  or dies, closes the environment and raises RuntimeError in the parent.
+  """
+
+  def __init__(self, num_workers=4, games_per_worker=8, timeout=60):
+    super().__init__()
+    self._num_workers = num_workers
+    self._batch_size = num_workers * games_per_worker
+    self._timeout = timeout
+    spec_env = BatchLanceEnvironment(1)
+    self._action_spec = spec_env.action_spec()
+    self._observation_spec = spec_env.observation_spec()
+
+    ctx = mp.get_context('fork')
+    n = self._batch_size
+    obs_shape = (n,) + self._observation_spec.shape
+    raw = [ctx.RawArray('i', 1),
+           ctx.RawArray('i', n),
+           ctx.RawArray('i', n),
+           ctx.RawArray('f', n),
+           ctx.RawArray('f', n),
+           ctx.RawArray('i', int(np.prod(obs_shape)))]
+    shapes = [(1,), (n,), (n,), (n,), (n,), obs_shape]
+    dtypes = [np.int32, np.int32, np.int32, np.float32, np.float32, np.int32]
+    self._shared = [as_array(r, s, d) for r, s, d in zip(raw, shapes, dtypes)]
+
+    self._start = ctx.Barrier(num_workers + 1)
+    self._done = ctx.Barrier(num_workers + 1)
+    self._errors = ctx.SimpleQueue()
+    self._processes = []
+    for i in range(num_workers):
+      p = ctx.Process(target=run_worker, daemon=True,
+                      args=(i, games_per_worker, self._shared, self._start,
+                            self._done, self._errors))
+      p.start()
+      self._processes.append(p)
+
+  @property
+  def batched(self):
+    return True
+
+  @property
+  def batch_size(self):
+    return self._batch_size
+
+  def action_spec(self):
+    return self._action_spec
+
+  def observation_spec(self):
+    return self._observation_spec
+
+  def _run(self, command):
+    """Release the workers with `command` and collect their time steps."""
+    if not self._processes:
+      raise RuntimeError('the environment is closed')
+    self._shared[0][0] = command
+    try:
+      self._start.wait(self._timeout)
+      self._done.wait(self._timeout)
+    except threading.BrokenBarrierError:
+      self._fail()
+    _, _, step_types, rewards, discounts, observations = self._shared
+    return ts.TimeStep(step_types.copy(), rewards.copy(), discounts.copy(),
+                       observations.astype(self._observation_spec.dtype))
+
+  def _reset(self):
+    return self._run(RESET)
+
+  def _step(self, action):
+    self._shared[1][:] = np.asarray(action).reshape(self._batch_size)
+    return self._run(STEP)
+
+  def _fail(self):
+    """Stop every worker and raise the first worker error, if there was one."""
+    dead = [i for i, p in enumerate(self._processes) if not p.is_alive()]
+    self._start.abort()
+    self._done.abort()
+    for p in self._processes:
+      p.join(1)
+      if p.is_alive():
+        p.kill()
+        p.join()
+    self._processes = []
+    if not self._errors.empty():
+      index, error = self._errors.get()
+      raise RuntimeError(f'collection worker {index} failed:\n{error}')
+    if dead:
+      raise RuntimeError(f'collection workers {dead} exited unexpectedly')
+    raise RuntimeError(f'collection workers did not answer within '
+                       f'{self._timeout} seconds')
+
+  def close(self):
+    if self._processes:
+      self._shared[0][0] = CLOSE
+      try:
+        self._start.wait(self._timeout)
+      except threading.BrokenBarrierError:
+        self._fail()
+      for p in self._processes:
+        p.join()
+      self._processes = []
+
+
+def steps_per_second(env, num_rounds):
+  """Step a batched env with random actions and return game steps per second."""
+  env.reset()
+  actions = np.random.randint(4, size=(num_rounds, env.batch_size))
+  start = time.perf_counter()
+  for action in actions.astype(np.int32):
+    env.step(action)
+  return num_rounds * env.batch_size / (time.perf_counter() - start)
+
+
+def benchmark(num_rounds=2000, worker_counts=(1, 2, 4, 8), games_per_worker=(1, 8, 32)):
+  """Report collection throughput of the in-process and multiprocess envs."""
+  env = LanceEnvironment()
+  env.reset()
+  start = time.perf_counter()
+  for action in np.random.randint(4, size=num_rounds).astype(np.int32):
+    env.step(action)
+  print(f'in-process: {num_rounds / (time.perf_counter() - start):,.0f} steps/sec')
+
+  for games in games_per_worker:
+    rate = steps_per_second(BatchLanceEnvironment(games), num_rounds)
+    print(f'in-process batch of {games}: {rate:,.0f} steps/sec')
+    for num_workers in worker_counts:
+      env = ParallelLanceEnvironment(num_workers, games)
+      rate = steps_per_second(env, num_rounds)
+      print(f'  {num_workers} workers x {games} games: {rate:,.0f} steps/sec')
+      env.close()
+
+
+def test_worker_failure():
+  """Check that an error in a worker is raised in the parent, not a hang."""
+  env = ParallelLanceEnvironment(num_workers=2, games_per_worker=4, timeout=10)
+  env.reset()
+  env.step(np.zeros(8, dtype=np.int32))
+  action = np.zeros(8, dtype=np.int32)
+  action[5] = 7  # invalid, so worker 1 raises ValueError
+  start = time.perf_counter()
+  try:
+    env.step(action)
+  except RuntimeError as e:
+    assert 'worker 1 failed' in str(e) and 'ValueError' in str(e), e
+  else:
+    raise AssertionError('worker error was not raised')
+  assert time.perf_counter() - start < 5
+  env.close()
+  print('Test successful.')
+
+
+if __name__ == '__main__':
+  if sys.argv[-1] == '--test':
+    test_worker_failure()
+  else:
+    benchmark()
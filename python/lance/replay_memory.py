@@ -0,0 +1,178 @@
+"""Compact replay memory for Lance transitions with optional prioritized sampling.
+
+A Lance observation is fully determined by four board cells (player, food and
+the two portals), so each state is stored as four uint8 cell indices and only
+decoded to (3, GAME_DIMENSION, GAME_DIMENSION) arrays when sampled.
+"""
+
+import time
+import numpy as np
+from game import GAME_DIMENSION
+
+
+NUM_CELLS = 4
+
+
+def encode_state(game):
+  """Return the flat board index of the player, food and portals of a game."""
+  cells = [game.player, game.food, game.portal1, game.portal2]
+  return np.array([x * GAME_DIMENSION + y for x, y in cells], dtype=np.uint8)
+
+
+def decode_states(states, dtype=np.float32):
+  """Expand (n, 4) cell indices into (n, 3, D, D) observations."""
+  n = len(states)
+  observations = np.zeros((n, 3, GAME_DIMENSION * GAME_DIMENSION), dtype=dtype)
+  rows = np.arange(n)
+  observations[rows, 0, states[:, 0]] = 1
+  observations[rows, 1, states[:, 1]] = 1
+  observations[rows, 2, states[:, 2]] = 1
+  observations[rows, 2, states[:, 3]] = 1
+  return observations.reshape(n, 3, GAME_DIMENSION, GAME_DIMENSION)
+
+
+class SumTree:
+  """Binary tree of priorities where each node holds the sum of its children.
+
+  Leaves live at `tree[size:2 * size]`; updates and prefix-sum lookups are
+  vectorized over batches and take O(log capacity).
+  """
+
+  def __init__(self, capacity):
+    self.size = 2
+    while self.size < capacity:
+      self.size *= 2
+    self.tree = np.zeros(2 * self.size, dtype=np.float64)
+
+  def total(self):
+    """Return the sum of all priorities."""
+    return self.tree[1]
+
+  def update(self, indices, priorities):
+    """Set the priorities of the given leaves and refresh their ancestors."""
+    nodes = np.asarray(indices) + self.size
+    self.tree[nodes] = priorities
+    while nodes[0] > 1:
+      nodes = np.unique(nodes // 2)
+      self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+  def find(self, values):
+    """Return the leaf index whose prefix-sum interval contains each value."""
+    values = np.array(values, dtype=np.float64)
+    nodes = np.ones(len(values), dtype=np.int64)
+    while nodes[0] < self.size:
+      left = 2 * nodes
+      go_right = values >= self.tree[left]
+      values -= self.tree[left] * go_right
+      nodes = left + go_right
+    return nodes - self.size
+
+
+class ReplayMemory:
+  """Preallocated ring buffer of (state, action, reward, discount, next state).
+
+  With `prioritized=True` transitions are sampled in proportion to
+  priority ** alpha and returned with importance weights; new transitions get
+  the largest priority seen so far.
+  """
+
+  def __init__(self, capacity, prioritized=False, alpha=0.6, rng=None):
+    self.rng = np.random.default_rng() if rng is None else rng
+    self.capacity = capacity
+    self.states = np.zeros((capacity, NUM_CELLS), dtype=np.uint8)
+    self.next_states = np.zeros((capacity, NUM_CELLS), dtype=np.uint8)
+    self.actions = np.zeros(capacity, dtype=np.uint8)
+    self.rewards = np.zeros(capacity, dtype=np.float32)
+    self.discounts = np.zeros(capacity, dtype=np.uint8)
+    self.size = 0
+    self.index = 0
+
+    self.alpha = alpha
+    self.max_priority = 1.0
+    self.tree = SumTree(capacity) if prioritized else None
+
+  @property
+  def bytes_per_transition(self):
+    arrays = [self.states, self.next_states, self.actions, self.rewards,
+              self.discounts]
+    return sum(a.nbytes for a in arrays) / self.capacity
+
+  def add(self, state, action, reward, discount, next_state):
+    """Store one transition, overwriting the oldest once full."""
+    self.add_batch(np.asarray(state)[None], [action], [reward], [discount],
+                   np.asarray(next_state)[None])
+
+  def add_batch(self, states, actions, rewards, discounts, next_states):
+    """Store a batch of transitions, e.g. from BatchLanceEnvironment."""
+    n = len(states)
+    i = (self.index + np.arange(n)) % self.capacity
+    self.states[i] = states
+    self.actions[i] = actions
+    self.rewards[i] = rewards
+    self.discounts[i] = discounts
+    self.next_states[i] = next_states
+    if self.tree is not None:
+      self.tree.update(i, self.max_priority ** self.alpha)
+    self.index = (self.index + n) % self.capacity
+    self.size = min(self.size + n, self.capacity)
+
+  def sample(self, n, beta=0.4, dtype=np.float32):
+    """Return n decoded transitions, their indices and importance weights."""
+    if self.tree is None:
+      i = self.rng.integers(self.size, size=n)
+      weights = np.ones(n, dtype=np.float32)
+    else:
+      total = self.tree.total()
+      # one value per stratum of the priority mass
+      values = (np.arange(n) + self.rng.random(n)) * total / n
+      i = np.minimum(self.tree.find(values), self.size - 1)
+      probabilities = self.tree.tree[i + self.tree.size] / total
+      weights = (self.size * probabilities) ** -beta
+      weights = (weights / weights.max()).astype(np.float32)
+    experience = (decode_states(self.states[i], dtype), self.actions[i],
+                  self.rewards[i], self.discounts[i].astype(np.float32),
+                  decode_states(self.next_states[i], dtype))
+    return experience, i, weights
+
+  def update_priorities(self, indices, priorities, epsilon=1e-6):
+    """Set new priorities, typically absolute TD errors, of sampled rows."""
+    if self.tree is None:
+      return
+    priorities = np.abs(priorities) + epsilon
+    self.max_priority = max(self.max_priority, float(priorities.max()))
+    self.tree.update(indices, priorities ** self.alpha)
+
+
+def benchmark(capacity=1_000_000, sample_size=4096, num_samples=100):
+  """Report memory use, insertion and sampling speed of a full memory."""
+  frame_bytes = 2 * 3 * GAME_DIMENSION * GAME_DIMENSION * 4
+  rng = np.random.default_rng()
+  states = rng.integers(GAME_DIMENSION ** 2, size=(capacity, NUM_CELLS),
+                        dtype=np.uint8)
+  actions = rng.integers(4, size=capacity)
+  rewards = rng.normal(size=capacity)
+  discounts = np.ones(capacity)
+
+  for prioritized in [False, True]:
+    memory = ReplayMemory(capacity, prioritized=prioritized, rng=rng)
+    start = time.perf_counter()
+    for j in range(0, capacity, 1000):
+      memory.add_batch(states[j:j + 1000], actions[j:j + 1000],
+                       rewards[j:j + 1000], discounts[j:j + 1000],
+                       states[j:j + 1000])
+    insert_rate = capacity / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(num_samples):
+      _, indices, _ = memory.sample(sample_size)
+      memory.update_priorities(indices, rng.random(sample_size))
+    sample_rate = num_samples * sample_size / (time.perf_counter() - start)
+
+    print(f'prioritized={prioritized}: '
+          f'{memory.bytes_per_transition:.0f} bytes/transition '
+          f'(int32 frames: {frame_bytes}), '
+          f'{insert_rate:,.0f} inserts/sec, {sample_rate:,.0f} samples/sec')
+
+
+if __name__ == '__main__':
+  benchmark()
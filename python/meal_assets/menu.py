@@ -0,0 +1,274 @@
+"""Indexed queries over meals.json.
+
+MenuIndex builds, once, an inverted index from item tokens to menu entries
+and a (week, day, meal) lookup table. `save` writes the same indexes to a
+compact binary file that MappedMenuIndex answers queries from through mmap,
+so a service can start without loading or reparsing the json.
+
+  python menu.py teriyaki chicken     days serving an item
+  python menu.py --benchmark          query latency against a linear scan
+"""
+
+import re
+import sys
+import mmap
+import json
+import time
+import bisect
+import struct
+import random
+
+
+MEALS_FILE = 'meals.json'
+INDEX_FILE = 'meals.idx'
+MAGIC = b'MEALIDX1'
+# fields of an entry or location key in the index file
+SEPARATOR = '\x1f'
+TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+  """Return the lowercase alphanumeric tokens of a text."""
+  return TOKEN.findall(text.lower())
+
+
+def load_meals(path=MEALS_FILE):
+  with open(path) as f:
+    return json.load(f)
+
+
+def scan(data, query):
+  """Find (week, day, meal) serving an item the slow way, for comparison."""
+  tokens = set(tokenize(query))
+  return [(week, day, meal)
+          for week, days in data.items()
+          for day, meals in days.items()
+          for meal, items in meals.items()
+          if any(tokens <= set(tokenize(item)) for item in items)]
+
+
+class BaseIndex:
+  """Queries shared by the in-memory and memory-mapped indexes.
+
+  Entries are the individual menu items, numbered in meals.json order.
+  Subclasses provide `entry(i)` as (week, day, meal, item), `postings(token)`
+  as sorted entry numbers and `entry_range(week, day, meal)`.
+  """
+
+  def search(self, query):
+    """Return (week, day, meal) with an item containing every query token."""
+    tokens = tokenize(query)
+    if not tokens:
+      return []
+    lists = sorted((self.postings(token) for token in tokens), key=len)
+    matches = set(lists[0])
+    for postings in lists[1:]:
+      matches.intersection_update(postings)
+    locations = []
+    for i in sorted(matches):
+      location = self.entry(i)[:3]
+      if not locations or locations[-1] != location:
+        locations.append(location)
+    return locations
+
+  def lookup(self, week, day, meal):
+    """Return the items served at one meal, or [] if it is not on the menu."""
+    start, end = self.entry_range(week.upper(), day.upper(), meal.upper())
+    return [self.entry(i)[3] for i in range(start, end)]
+
+
+class MenuIndex(BaseIndex):
+  """Indexes built in memory from the nested meals.json dictionary."""
+
+  def __init__(self, data):
+    self.entries = []
+    self.ranges = {}
+    self.tokens = {}
+    for week, days in data.items():
+      for day, meals in days.items():
+        for meal, items in meals.items():
+          start = len(self.entries)
+          for item in items:
+            for token in set(tokenize(item)):
+              self.tokens.setdefault(token, []).append(len(self.entries))
+            self.entries.append((week, day, meal, item))
+          self.ranges[week, day, meal] = (start, len(self.entries))
+
+  @classmethod
+  def load(cls, path=MEALS_FILE):
+    return cls(load_meals(path))
+
+  def entry(self, i):
+    return self.entries[i]
+
+  def postings(self, token):
+    return self.tokens.get(token, [])
+
+  def entry_range(self, week, day, meal):
+    return self.ranges.get((week, day, meal), (0, 0))
+
+  def save(self, path=INDEX_FILE):
+    """Write the indexes as a file MappedMenuIndex can open.
+
+    Layout, all integers little-endian uint32: magic, then the entry,
+    location, token and posting counts, then three string tables (entries in
+    json order, location keys and tokens in sorted byte order) each stored as
+    count + 1 offsets followed by utf-8 bytes, the (start, end) entry range of
+    every location, count + 1 posting offsets per token and the postings.
+    """
+    entries = [SEPARATOR.join(entry).encode() for entry in self.entries]
+    locations = sorted((SEPARATOR.join(key).encode(), span)
+                       for key, span in self.ranges.items())
+    tokens = sorted((token.encode(), postings)
+                    for token, postings in self.tokens.items())
+    postings = [i for _, p in tokens for i in p]
+    posting_offsets = [0]
+    for _, p in tokens:
+      posting_offsets.append(posting_offsets[-1] + len(p))
+
+    with open(path, 'wb') as f:
+      f.write(MAGIC)
+      f.write(struct.pack('<4I', len(entries), len(locations), len(tokens),
+                          len(postings)))
+      for strings in (entries, [key for key, _ in locations],
+                      [token for token, _ in tokens]):
+        write_strings(f, strings)
+      write_uints(f, [i for _, span in locations for i in span])
+      write_uints(f, posting_offsets)
+      write_uints(f, postings)
+
+
+def write_uints(f, values):
+  f.write(struct.pack('<{}I'.format(len(values)), *values))
+
+
+def write_strings(f, strings):
+  """Write count + 1 offsets and the concatenated strings, padded to 4 bytes."""
+  offsets = [0]
+  for s in strings:
+    offsets.append(offsets[-1] + len(s))
+  write_uints(f, offsets)
+  blob = b''.join(strings)
+  f.write(blob + b'\0' * (-len(blob) % 4))
+
+
+class StringTable:
+  """Sequence of byte strings read straight from an index file."""
+
+  def __init__(self, buffer, position, count):
+    self.offsets = buffer[position: position + 4 * (count + 1)].cast('I')
+    self.start = position + 4 * (count + 1)
+    self.buffer = buffer
+    self.end = self.start + self.offsets[-1]
+    self.end += -self.end % 4
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, i):
+    return bytes(self.buffer[self.start + self.offsets[i]:
+                             self.start + self.offsets[i + 1]])
+
+  def find(self, key):
+    """Return the position of an exact key, or -1."""
+    i = bisect.bisect_left(self, key)
+    return i if i < len(self) and self[i] == key else -1
+
+
+class MappedMenuIndex(BaseIndex):
+  """Indexes answered from a file written by MenuIndex.save, via mmap.
+
+  Opening only maps the file and reads its header; queries touch just the
+  pages they bisect through, so startup cost does not grow with the menu.
+  """
+
+  def __init__(self, path=INDEX_FILE):
+    with open(path, 'rb') as f:
+      self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    buffer = memoryview(self.map)
+    if buffer[:len(MAGIC)] != MAGIC:
+      raise ValueError('{} is not a meal index'.format(path))
+    position = len(MAGIC)
+    counts = struct.unpack_from('<4I', buffer, position)
+    n_entries, n_locations, n_tokens, n_postings = counts
+    position += 16
+    self.entries = StringTable(buffer, position, n_entries)
+    self.locations = StringTable(buffer, self.entries.end, n_locations)
+    self.tokens = StringTable(buffer, self.locations.end, n_tokens)
+    position = self.tokens.end
+    self.ranges = buffer[position: position + 8 * n_locations].cast('I')
+    position += 8 * n_locations
+    self.posting_offsets = buffer[position: position + 4 * (n_tokens + 1)].cast('I')
+    position += 4 * (n_tokens + 1)
+    self.all_postings = buffer[position: position + 4 * n_postings].cast('I')
+
+  def entry(self, i):
+    return tuple(self.entries[i].decode().split(SEPARATOR))
+
+  def postings(self, token):
+    i = self.tokens.find(token.encode())
+    if i < 0:
+      return []
+    return self.all_postings[self.posting_offsets[i]: self.posting_offsets[i + 1]]
+
+  def entry_range(self, week, day, meal):
+    i = self.locations.find(SEPARATOR.join((week, day, meal)).encode())
+    if i < 0:
+      return 0, 0
+    return self.ranges[2 * i], self.ranges[2 * i + 1]
+
+
+def time_per_call(function, args_list):
+  """Return the mean microseconds per call over a list of argument tuples."""
+  start = time.perf_counter()
+  for args in args_list:
+    function(*args)
+  return (time.perf_counter() - start) / len(args_list) * 1e6
+
+
+def benchmark(num_queries=2000, seed=0):
+  """Compare startup and query latency of a linear scan and both indexes."""
+  start = time.perf_counter()
+  data = load_meals()
+  load_ms = (time.perf_counter() - start) * 1000
+  start = time.perf_counter()
+  index = MenuIndex(data)
+  build_ms = (time.perf_counter() - start) * 1000
+  index.save()
+  start = time.perf_counter()
+  mapped = MappedMenuIndex()
+  open_ms = (time.perf_counter() - start) * 1000
+  print(f'json load {load_ms:.2f} ms, index build {build_ms:.2f} ms, '
+        f'mmap open {open_ms:.3f} ms')
+
+  rng = random.Random(seed)
+  items = [entry[3] for entry in index.entries]
+  queries = [(rng.choice(items),) for _ in range(num_queries)]
+  keys = [rng.choice(list(index.ranges)) for _ in range(num_queries)]
+  assert all(scan(data, q) == index.search(q) == mapped.search(q)
+             for q, in queries[:200])
+  assert all(index.lookup(*k) == mapped.lookup(*k) == data[k[0]][k[1]][k[2]]
+             for k in keys[:200])
+
+  def scan_lookup(week, day, meal):
+    for w, days in data.items():
+      for d, meals in days.items():
+        for m, served in meals.items():
+          if (w, d, m) == (week, day, meal):
+            return served
+    return []
+
+  print(f'search: scan {time_per_call(lambda q: scan(data, q), queries):.1f} us, '
+        f'index {time_per_call(index.search, queries):.1f} us, '
+        f'mmap {time_per_call(mapped.search, queries):.1f} us')
+  print(f'lookup: scan {time_per_call(scan_lookup, keys):.1f} us, '
+        f'index {time_per_call(index.lookup, keys):.1f} us, '
+        f'mmap {time_per_call(mapped.lookup, keys):.1f} us')
+
+
+if __name__ == '__main__':
+  if sys.argv[-1] == '--benchmark':
+    benchmark()
+  else:
+    for week, day, meal in MenuIndex.load().search(' '.join(sys.argv[1:])):
+      print(week, day, meal)
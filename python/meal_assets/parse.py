@@ -1,11 +1,31 @@
 """A module for converting .docx meal schedules to json."""
 
 
+import os
+import sys
+import time
 import glob
 import json
+import hashlib
+import zipfile
+import tempfile
+import tracemalloc
+import concurrent.futures
+import xml.etree.ElementTree as ET
 import docx
 
 
+# parsed weeks keyed by docx content hash
+CACHE_FILE = 'parse_cache.json'
+# bump when parser output changes so cached weeks are reparsed
+PARSER_VERSION = 3
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+# run children that python-docx turns into text; outside a run, e.g. tab
+# stops in w:pPr/w:tabs, they are formatting only
+RUN_TEXT = {W + 'tab': '\t', W + 'ptab': '\t', W + 'br': '\n', W + 'cr': '\n',
+            W + 'noBreakHyphen': '-'}
+
+
 def cell_to_list(unstructured_cell):
   """Clean up a text and return a list of nonempty items."""
   items = unstructured_cell.split('\n')
@@ -32,21 +52,208 @@ def parse_docx(filepath):
   return data
 
 
-def build_json():
-  """Build json data for meals."""
-  doc_files = glob.glob('word_docs/*.docx')
+def expand_table(rows):
+  """Turn rows of (text, span, vmerge) cells into a grid of cell texts.
+
+  A cell spanning several grid columns fills each of them, and a vertically
+  merged continuation cell repeats the text of the cell above, which is what
+  python-docx reports for merged cells.
+  """
+  grid = []
+  for row in rows:
+    texts = []
+    for text, span, vmerge in row:
+      column = len(texts)
+      if vmerge == 'continue' and grid and column < len(grid[-1]):
+        text = grid[-1][column]
+      texts += [text] * span
+    grid.append(texts)
+  return grid
+
+
+def iter_tables(filepath):
+  """Stream word/document.xml and yield each top-level table as a text grid.
+
+  Only one table is held in memory at a time. Tables nested inside a cell are
+  skipped, as python-docx leaves them out of the cell text too. Text is only
+  taken from inside runs (w:r), as python-docx does.
+  """
+  depth = 0
+  in_run = False
+  rows = row = paragraphs = para = None
+  span, vmerge = 1, None
+  with zipfile.ZipFile(filepath) as z, z.open('word/document.xml') as f:
+    for event, elem in ET.iterparse(f, events=('start', 'end')):
+      tag = elem.tag
+      if event == 'start':
+        if tag == W + 'tbl':
+          depth += 1
+          if depth == 1:
+            rows = []
+        elif depth != 1:
+          continue
+        elif tag == W + 'tr':
+          row = []
+        elif tag == W + 'tc':
+          paragraphs, span, vmerge = [], 1, None
+        elif tag == W + 'p':
+          para = []
+        elif tag == W + 'r':
+          in_run = True
+        continue
+
+      if tag == W + 'tbl':
+        depth -= 1
+        if depth == 0:
+          yield expand_table(rows)
+          elem.clear()
+      elif depth == 0:
+        # drop body paragraphs between tables as soon as they are read
+        if tag == W + 'p':
+          elem.clear()
+      elif depth != 1:
+        continue
+      elif tag == W + 'r':
+        in_run = False
+      elif tag == W + 't' and in_run:
+        para.append(elem.text or '')
+      elif tag in RUN_TEXT and in_run:
+        para.append(RUN_TEXT[tag])
+      elif tag == W + 'p':
+        paragraphs.append(''.join(para))
+      elif tag == W + 'gridSpan':
+        span = int(elem.get(W + 'val'))
+      elif tag == W + 'vMerge':
+        vmerge = elem.get(W + 'val', 'continue')
+      elif tag == W + 'tc':
+        row.append(('\n'.join(paragraphs), span, vmerge))
+      elif tag == W + 'tr':
+        rows.append(row)
+
+
+def parse_docx_xml(filepath):
+  """Parse a docx without python-docx, merging the meals of every table."""
   data = {}
+  for grid in iter_tables(filepath):
+    if not grid:
+      continue
+    weekdays = [text.upper() for text in grid[0]]
+    meal_names = [row[0] if row else '' for row in grid]
+    for column, weekday in enumerate(weekdays):
+      if weekday:
+        meals = data.setdefault(weekday, {})
+        meals.update({meal: cell_to_list(row[column])
+                      for meal, row in zip(meal_names, grid)
+                      if meal and column < len(row)})
+  return data
+
+
+def file_hash(filepath):
+  """Return the sha256 hex digest of a file's contents."""
+  with open(filepath, 'rb') as f:
+    return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_cache():
+  """Return the cached {file hash: parsed week} dictionary."""
+  if os.path.exists(CACHE_FILE):
+    with open(CACHE_FILE) as f:
+      cache = json.load(f)
+    if cache.get('version') == PARSER_VERSION:
+      return cache['weeks']
+  return {}
+
+
+def build_json():
+  """Build json data for meals, reparsing only docx files that changed."""
+  doc_files = sorted(glob.glob('word_docs/*.docx'))
+
+  cache = load_cache()
+  hashes = {f: file_hash(f) for f in doc_files}
+  changed = [f for f in doc_files if hashes[f] not in cache]
+  if changed:
+    with concurrent.futures.ProcessPoolExecutor() as pool:
+      for f, week in zip(changed, pool.map(parse_docx_xml, changed)):
+        cache[hashes[f]] = week
+  # only keep entries for the current files
+  cache = {hashes[f]: cache[hashes[f]] for f in doc_files}
+  with open(CACHE_FILE, 'w') as f:
+    json.dump({'version': PARSER_VERSION, 'weeks': cache}, f)
+
+  data = {f[10:15].upper(): cache[hashes[f]] for f in doc_files}
+  text = json.dumps(data, indent=2)
+  old_text = None
+  if os.path.exists('meals.json'):
+    with open('meals.json') as f:
+      old_text = f.read()
+  if text != old_text:
+    with open('meals.json', 'w') as f:
+      f.write(text)
+
+  print('Parsed {} files, {} served from cache; meals.json {}.'.format(
+      len(changed), len(doc_files) - len(changed),
+      'unchanged' if text == old_text else 'updated'))
+
+
+def benchmark(repeat=5):
+  """Compare time, peak memory and output of both parsers on word_docs."""
+  doc_files = sorted(glob.glob('word_docs/*.docx'))
+  outputs = []
+  for name, parse in [('python-docx', parse_docx), ('xml stream', parse_docx_xml)]:
+    results = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+      for f in doc_files:
+        try:
+          results[f] = parse(f)
+        except Exception as e:  # pylint: disable=broad-except
+          results[f] = repr(e)
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    for f in doc_files:
+      try:
+        parse(f)
+      except Exception:  # pylint: disable=broad-except
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{name}: {elapsed * 1000:.1f} ms for {len(doc_files)} files, '
+          f'peak {peak / 1024:.0f} KiB')
+    outputs.append(results)
   for f in doc_files:
-    week_name = f[10:15]
-    # some issue with week3 docx formatting
-    # also note that week4 docx has two tables
-    # avoid dealing with these for now
-    if week_name not in ['week3', 'week4']:
-      data[week_name.upper()] = parse_docx(f)
+    print(f, 'identical' if outputs[0][f] == outputs[1][f] else 'differs')
+
 
-  with open('meals.json', 'w') as f:
-    json.dump(data, f, indent=2)
+def test_parity():
+  """Check both parsers agree on a table with tab stops, tabs and breaks."""
+  doc = docx.Document()
+  table = doc.add_table(rows=3, cols=3)
+  for column, day in enumerate(['', 'Monday', 'Tuesday']):
+    table.cell(0, column).text = day
+  table.cell(1, 0).text = 'Breakfast'
+  table.cell(2, 0).text = 'Lunch'
+  table.cell(1, 1).text = 'Eggs\nToast'
+  table.cell(1, 2).paragraphs[0].add_run('Oatmeal\twith fruit')
+  table.cell(2, 1).merge(table.cell(2, 2)).text = 'Soup'
+  # tab stops are paragraph formatting, not text
+  table.cell(0, 2).paragraphs[0].paragraph_format.tab_stops.add_tab_stop(
+      docx.shared.Inches(1))
+  table.cell(1, 1).add_paragraph().paragraph_format.tab_stops.add_tab_stop(
+      docx.shared.Inches(1))
+  with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, 'week9.docx')
+    doc.save(path)
+    expected = parse_docx(path)
+    assert expected['TUESDAY']['Breakfast'] == ['Oatmeal\twith fruit']
+    assert expected['MONDAY']['Breakfast'] == ['Eggs', 'Toast']
+    assert parse_docx_xml(path) == expected, parse_docx_xml(path)
+  print('test_parity passed')
 
 
 if __name__ == '__main__':
-  build_json()
+  if sys.argv[-1] == '--benchmark':
+    benchmark()
+  elif sys.argv[-1] == '--test':
+    test_parity()
+  else:
+    build_json()
@@ -0,0 +1,16 @@
+"""Run the game logic of every pygame example headless and report ticks/sec."""
+
+import os
+import sys
+import bounce
+import snake
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'lance'))
+import lance  # pylint: disable=wrong-import-position
+
+
+if __name__ == '__main__':
+  num_ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+  for game in [lance, snake, bounce]:
+    game.benchmark(num_ticks)
@@ -1,50 +1,180 @@
 # run with pythonw on mac
+# run headless with: python bounce.py --benchmark
+# dump frame timings with: python bounce.py --stats frames.csv
 
+import sys
+import time
 import random
 import math
+import numpy as np
 import pygame
-pygame.init()
+import game_loop
 
-screen = pygame.display.set_mode([400, 400])
-pygame.display.set_caption('Hello World')
 
+WIDTH, HEIGHT = 400, 400
+# game logic ticks per second
+TICK_RATE = 60
 
-class Ball:
-  def __init__(self, x, y, dx, dy):
-    self.x = x
-    self.y = y
-    self.r = 10
-    self.dx = dx
-    self.dy = dy
-    self.n_steps = 0
+
+class BallSystem:
+  """All balls stored as contiguous numpy arrays, one entry per ball."""
+
+  def __init__(self, capacity=1024, r=10, max_age=500, collisions=False):
+    self.n = 0
+    self.default_r = r
+    self.max_age = max_age
+    self.collisions = collisions
     self.color = (0, 0, 255)
+    self.x = np.zeros(capacity)
+    self.y = np.zeros(capacity)
+    self.dx = np.zeros(capacity)
+    self.dy = np.zeros(capacity)
+    self.r = np.zeros(capacity)
+    self.age = np.zeros(capacity, dtype=np.int64)
+
+  def __len__(self):
+    return self.n
+
+  def _arrays(self):
+    return [self.x, self.y, self.dx, self.dy, self.r, self.age]
+
+  def _grow(self, capacity):
+    names = ['x', 'y', 'dx', 'dy', 'r', 'age']
+    for name, a in zip(names, self._arrays()):
+      bigger = np.zeros(capacity, dtype=a.dtype)
+      bigger[:self.n] = a[:self.n]
+      setattr(self, name, bigger)
+
+  def add(self, x, y, dx, dy, r=None):
+    """Spawn one ball, or many if given arrays."""
+    x, y, dx, dy = np.broadcast_arrays(*map(np.atleast_1d, (x, y, dx, dy)))
+    k = len(x)
+    if self.n + k > len(self.x):
+      self._grow(max(2 * len(self.x), self.n + k))
+    s = slice(self.n, self.n + k)
+    self.x[s], self.y[s], self.dx[s], self.dy[s] = x, y, dx, dy
+    self.r[s] = self.default_r if r is None else r
+    self.age[s] = 0
+    self.n += k
+
+  def step(self, w, h):
+    """Reflect off the walls, move, then expire old balls, all vectorized."""
+    if self.collisions:
+      self.collide()
+    n = self.n
+    x, y, dx, dy, r, age = [a[:n] for a in self._arrays()]
+    dx[(x - r < 0) | (x + r > w)] *= -1
+    dy[(y - r < 0) | (y + r > h)] *= -1
+    x += dx
+    y += dy
+    age += 1
+    self.expire()
+
+  def expire(self):
+    """Drop balls older than max_age by compacting the live ones to the front."""
+    keep = self.age[:self.n] <= self.max_age
+    k = int(np.count_nonzero(keep))
+    if k < self.n:
+      for a in self._arrays():
+        a[:k] = a[:self.n][keep]
+      self.n = k
 
-  def update_position(self):
-    self.x += self.dx
-    self.y += self.dy
-    self.n_steps += 1
+  def candidate_pairs(self):
+    """Return index arrays (i, j) of balls sharing or neighboring a grid cell.
 
-  def draw(self):
-    pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), self.r)
+    Cells are as wide as the largest ball, so touching balls are always in the
+    same or adjacent cells. Balls are sorted by cell and each cell is paired
+    with itself and four forward neighbors so every pair appears once.
+    """
+    n = self.n
+    x, y, r = self.x[:n], self.y[:n], self.r[:n]
+    size = 2 * r.max()
+    ix = ((x - x.min()) // size).astype(np.int64)
+    iy = ((y - y.min()) // size).astype(np.int64)
+    ny = iy.max() + 2
+    keys = ix * ny + iy
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
 
-  def hit_wall(self):
-    w, h = screen.get_width(), screen.get_height()
-    if self.x - self.r < 0 or self.x + self.r > w:
-      self.dx *= -1
-    if self.y - self.r < 0 or self.y + self.r > h:
-      self.dy *= -1
+    pairs_i, pairs_j = [], []
+    for offset in [0, ny - 1, ny, ny + 1, 1]:
+      if offset == 0:
+        # balls later in the same cell
+        start = np.arange(1, n + 1)
+      else:
+        start = np.searchsorted(sorted_keys, sorted_keys + offset, 'left')
+      end = np.searchsorted(sorted_keys, sorted_keys + offset, 'right')
+      counts = np.maximum(end - start, 0)
+      total = counts.sum()
+      if total == 0:
+        continue
+      first = np.repeat(np.arange(n), counts)
+      within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+      pairs_i.append(order[first])
+      pairs_j.append(order[np.repeat(start, counts) + within])
+    if not pairs_i:
+      return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+  def brute_force_pairs(self):
+    """Return every pair (i < j) as index arrays, for comparison."""
+    return np.triu_indices(self.n, k=1)
+
+  def collide(self, pairs=None):
+    """Resolve overlapping, approaching pairs with elastic impulses.
+
+    Ball mass is proportional to area. All contacts are resolved at once with
+    equal and opposite impulses, so momentum is conserved exactly; energy is
+    conserved exactly for isolated pairs.
+    """
+    if self.n < 2:
+      return
+    i, j = self.candidate_pairs() if pairs is None else pairs
+    nx = self.x[j] - self.x[i]
+    ny = self.y[j] - self.y[i]
+    dist2 = nx * nx + ny * ny
+    touching = (dist2 < (self.r[i] + self.r[j]) ** 2) & (dist2 > 0)
+    i, j, nx, ny = i[touching], j[touching], nx[touching], ny[touching]
+    dist = np.sqrt(dist2[touching])
+    nx /= dist
+    ny /= dist
+    approach = (self.dx[i] - self.dx[j]) * nx + (self.dy[i] - self.dy[j]) * ny
+    moving_in = approach > 0
+    i, j, nx, ny = i[moving_in], j[moving_in], nx[moving_in], ny[moving_in]
+    approach = approach[moving_in]
+
+    mi, mj = self.r[i] ** 2, self.r[j] ** 2
+    impulse = 2 * approach / (1 / mi + 1 / mj)
+    np.add.at(self.dx, i, -impulse * nx / mi)
+    np.add.at(self.dy, i, -impulse * ny / mi)
+    np.add.at(self.dx, j, impulse * nx / mj)
+    np.add.at(self.dy, j, impulse * ny / mj)
+
+  def draw(self, screen):
+    for x, y, r in zip(self.x[:self.n].astype(int), self.y[:self.n].astype(int),
+                       self.r[:self.n].astype(int)):
+      pygame.draw.circle(screen, self.color, (x, y), r)
 
 
 class Cannon:
-  def __init__(self):
+  def __init__(self, width=WIDTH, height=HEIGHT, collisions=False):
+    self.width = width
+    self.height = height
     self.theta = 0
-    self.tip = None
     self.color = (0, 255, 0)
-    self.balls = []
+    self.balls = BallSystem(collisions=collisions)
+
+  @property
+  def base(self):
+    return self.width // 2, self.height - 5
+
+  @property
+  def tip(self):
+    x, y = self.base
+    return x + math.sin(self.theta) * 80, y - math.cos(self.theta) * 80
 
-  def draw(self):
-    x = screen.get_width() // 2
-    y = screen.get_height() - 5
+  def draw(self, screen):
+    x, y = self.base
     dy = 80
     dx = 10
 
@@ -57,11 +187,8 @@ class Cannon:
     p4 = int(p3[0] - math.sin(self.theta) *
              dy), int(p3[1] + math.cos(self.theta) * dy)
 
-    self.tip = x + math.sin(self.theta) * dy, y - math.cos(self.theta) * dy
-
     pygame.draw.polygon(screen, self.color, [p1, p2, p3, p4])
-    for b in self.balls:
-      b.draw()
+    self.balls.draw(screen)
 
   def update(self, key):
     if key == pygame.K_LEFT:
@@ -71,32 +198,124 @@ class Cannon:
 
   def shoot(self, key):
     if key == pygame.K_SPACE:
-      dx = 2 * math.sin(self.theta)
-      dy = -2 * math.cos(self.theta)
-      self.balls.append(Ball(self.tip[0], self.tip[1], dx, dy))
+      self.fire()
+
+  def fire(self):
+    dx = 2 * math.sin(self.theta)
+    dy = -2 * math.cos(self.theta)
+    self.balls.add(self.tip[0], self.tip[1], dx, dy)
+
+  def step(self):
+    """Move every ball one tick and drop those older than 500 steps."""
+    self.balls.step(self.width, self.height)
+
 
+def main(stats_csv=None):
+  pygame.init()
+  screen = pygame.display.set_mode([WIDTH, HEIGHT])
+  pygame.display.set_caption('Hello World')
 
-c = Cannon()
+  c = Cannon()
 
-running = True
-while running:
-  for event in pygame.event.get():
-    if event.type == pygame.QUIT:
-      running = False
-    elif event.type == pygame.KEYDOWN:
+  def handle_event(event):
+    if event.type == pygame.KEYDOWN:
       c.update(event.key)
       c.shoot(event.key)
 
-  screen.fill((255, 255, 255))
-  c.draw()
+  game_loop.run(screen, c.step, c.draw, handle_event, tick_rate=TICK_RATE,
+                stats_csv=stats_csv)
+  pygame.quit()
+
+
+def benchmark(num_ticks=1_000_000, fire_every=10):
+  """Run the game logic without rendering and report ticks per second."""
+  c = Cannon()
+  start = time.perf_counter()
+  for i in range(num_ticks):
+    if i % fire_every == 0:
+      c.theta = random.uniform(-1, 1)
+      c.fire()
+    c.step()
+  elapsed = time.perf_counter() - start
+  print(f'bounce: {num_ticks / elapsed:,.0f} ticks/sec '
+        f'with {len(c.balls)} balls')
+
+
+def benchmark_balls(num_balls=100_000, num_frames=600):
+  """Report frames per second of the ball engine with many live balls."""
+  c = Cannon()
+  c.balls.max_age = num_frames + 1
+  for _ in range(num_balls):
+    c.theta = random.uniform(-1.5, 1.5)
+    c.fire()
+  start = time.perf_counter()
+  for _ in range(num_frames):
+    c.step()
+  elapsed = time.perf_counter() - start
+  print(f'bounce: {num_frames / elapsed:,.0f} fps with {len(c.balls)} balls')
+
+
+def benchmark_collisions(ball_counts=(500, 1000, 2000, 4000, 100_000)):
+  """Compare frame time of spatial hash and all-pairs collision checks."""
+  for n in ball_counts:
+    # scale the board so ball density stays constant
+    side = 40 * np.sqrt(n)
+    balls = BallSystem(collisions=True)
+    balls.add(np.random.uniform(0, side, n), np.random.uniform(0, side, n),
+              np.random.uniform(-2, 2, n), np.random.uniform(-2, 2, n))
+    start = time.perf_counter()
+    for _ in range(10):
+      balls.step(side, side)
+    grid_ms = (time.perf_counter() - start) * 100
+    line = f'{n:>7} balls: spatial hash {grid_ms:8.2f} ms/frame'
+    # all pairs needs n ** 2 memory, skip it for large counts
+    if n <= 5000:
+      balls.collisions = False
+      start = time.perf_counter()
+      for _ in range(10):
+        balls.collide(balls.brute_force_pairs())
+        balls.step(side, side)
+      line += f', all pairs {(time.perf_counter() - start) * 100:8.2f} ms/frame'
+    print(line)
+
+
+def test_collisions():
+  """Check momentum and energy conservation and that no contacts are missed."""
+  balls = BallSystem()
+  balls.add([100, 112], [100, 103], [1, -2], [0.5, 0], r=[10, 6])
+
+  def totals():
+    m = balls.r[:2] ** 2
+    momentum = (m @ balls.dx[:2], m @ balls.dy[:2])
+    energy = m @ (balls.dx[:2] ** 2 + balls.dy[:2] ** 2) / 2
+    return np.array(momentum), energy
+
+  momentum, energy = totals()
+  old_dx = balls.dx[:2].copy()
+  balls.collide()
+  assert not np.allclose(balls.dx[:2], old_dx)
+  new_momentum, new_energy = totals()
+  assert np.allclose(momentum, new_momentum)
+  assert np.isclose(energy, new_energy)
+
+  balls = BallSystem()
+  balls.add(np.random.uniform(0, 500, 1000), np.random.uniform(0, 500, 1000),
+            0, 0, r=np.random.uniform(2, 10, 1000))
 
-  for i, b in enumerate(c.balls):
-    b.hit_wall()
-    b.update_position()
-    if b.n_steps > 500:
-      del c.balls[i]
+  def touching(i, j):
+    d2 = (balls.x[i] - balls.x[j]) ** 2 + (balls.y[i] - balls.y[j]) ** 2
+    keep = d2 < (balls.r[i] + balls.r[j]) ** 2
+    return set(zip(np.minimum(i, j)[keep], np.maximum(i, j)[keep]))
+  assert touching(*balls.candidate_pairs()) == touching(*balls.brute_force_pairs())
+  print('Test successful.')
 
-  # updates pygame display
-  pygame.display.flip()
 
-pygame.quit()
+if __name__ == '__main__':
+  if sys.argv[-1] == '--benchmark':
+    benchmark()
+    benchmark_balls()
+    benchmark_collisions()
+  elif sys.argv[-1] == '--test':
+    test_collisions()
+  else:
+    main(game_loop.stats_path(sys.argv))
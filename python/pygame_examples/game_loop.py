@@ -0,0 +1,159 @@
+"""Fixed-timestep game loop with decoupled rendering and frame timing stats.
+
+Game logic advances in fixed ticks of 1 / tick_rate seconds using an
+accumulator, so it runs at the same speed on fast and slow machines, while
+rendering happens once per loop iteration at whatever rate the display allows.
+"""
+
+import csv
+import time
+import collections
+import pygame
+
+
+class FrameStats:
+  """Per-frame update time, render time, ticks and total frame time.
+
+  Averages cover every frame, percentiles only the last `capacity` frames,
+  so memory stays bounded however long the game runs. With `csv_path`,
+  each frame is written out as it is recorded.
+  """
+
+  columns = ['update_ms', 'render_ms', 'ticks', 'frame_ms']
+
+  def __init__(self, capacity=10_000, csv_path=None):
+    self.rows = collections.deque(maxlen=capacity)
+    self.count = 0
+    self.totals = [0.0] * len(self.columns)
+    self.file = self.writer = None
+    if csv_path:
+      self.file = open(csv_path, 'w', newline='')
+      self.writer = csv.writer(self.file)
+      self.writer.writerow(self.columns)
+
+  def record(self, update_ms, render_ms, ticks, frame_ms):
+    row = (update_ms, render_ms, ticks, frame_ms)
+    self.rows.append(row)
+    self.count += 1
+    for i, value in enumerate(row):
+      self.totals[i] += value
+    if self.writer:
+      self.writer.writerow(row)
+
+  def percentile(self, column, q):
+    """Return the q-th percentile of a column, e.g. percentile('frame_ms', 99)."""
+    values = sorted(row[self.columns.index(column)] for row in self.rows)
+    if not values:
+      return 0.0
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+  def summary(self):
+    n = self.count
+    if n == 0:
+      return 'no frames recorded'
+    update, render, ticks, _ = (total / n for total in self.totals)
+    return (f'{n} frames, update {update:.2f} ms, render {render:.2f} ms, '
+            f'{ticks:.2f} ticks/frame, '
+            f'frame p50 {self.percentile("frame_ms", 50):.2f} ms, '
+            f'p99 {self.percentile("frame_ms", 99):.2f} ms')
+
+  def close(self):
+    if self.file:
+      self.file.close()
+      self.file = self.writer = None
+
+
+class DirtyRects:
+  """Erase last frame's sprites and return only the regions that changed.
+
+  `draw(screen)` must return the rects it painted, which pygame.draw functions
+  already do. The union of old and new rects is what needs pushing to the
+  display; nothing is pushed when the sprites did not move.
+  """
+
+  def __init__(self, background=(255, 255, 255)):
+    self.background = background
+    self.previous = []
+
+  def draw(self, screen, draw):
+    for rect in self.previous:
+      screen.fill(self.background, rect)
+    rects = draw(screen)
+    dirty = [] if rects == self.previous else self.previous + rects
+    self.previous = rects
+    return dirty
+
+
+def stats_path(argv):
+  """Return the file given after `--stats` on the command line, if any."""
+  if '--stats' in argv[:-1]:
+    return argv[argv.index('--stats') + 1]
+  return None
+
+
+def run(screen, step, draw, handle_event=None, tick_rate=60,
+        max_ticks_per_frame=5, max_fps=60, stats_csv=None, dirty_rects=False):
+  """Run until the window is closed, returning the collected FrameStats.
+
+  `step()` advances the game one tick, `draw(screen)` paints a frame and
+  `handle_event(event)` receives every event except QUIT. If a frame falls
+  more than `max_ticks_per_frame` ticks behind, the backlog is dropped so a
+  slow machine slows the game down instead of freezing. Rendering is capped
+  at `max_fps` frames per second, sleeping in between; `max_fps=0` renders as
+  fast as possible. With `dirty_rects=True`, `draw` must return the rects
+  it painted and only changed regions are repainted and pushed to the display
+  instead of filling and flipping the whole screen.
+  """
+  dt = 1 / tick_rate
+  clock = pygame.time.Clock()
+  stats = FrameStats(csv_path=stats_csv)
+  accumulator = 0.0
+  tracker = DirtyRects() if dirty_rects else None
+  if tracker:
+    screen.fill(tracker.background)
+    pygame.display.flip()
+  previous = time.perf_counter()
+
+  running = True
+  while running:
+    frame_start = time.perf_counter()
+    accumulator += frame_start - previous
+    previous = frame_start
+
+    for event in pygame.event.get():
+      if event.type == pygame.QUIT:
+        running = False
+      elif handle_event is not None:
+        handle_event(event)
+
+    update_start = time.perf_counter()
+    ticks = 0
+    while accumulator >= dt and ticks < max_ticks_per_frame:
+      step()
+      accumulator -= dt
+      ticks += 1
+    if ticks == max_ticks_per_frame:
+      accumulator = min(accumulator, dt)
+    update_end = time.perf_counter()
+
+    if tracker:
+      rects = tracker.draw(screen, draw)
+      if rects:
+        pygame.display.update(rects)
+    else:
+      screen.fill((255, 255, 255))
+      draw(screen)
+      # updates pygame display
+      pygame.display.flip()
+    render_end = time.perf_counter()
+    if max_fps:
+      clock.tick(max_fps)
+
+    # frame time includes any wait for max_fps, so it matches the frame rate
+    stats.record((update_end - update_start) * 1000,
+                 (render_end - update_end) * 1000, ticks,
+                 (time.perf_counter() - frame_start) * 1000)
+
+  stats.close()
+  print(stats.summary())
+  return stats
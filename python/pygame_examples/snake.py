@@ -1,22 +1,30 @@
 # run with pythonw on mac
+# run headless with: python snake.py --benchmark
+# dump frame timings with: python snake.py --stats frames.csv
 
+import sys
+import time
 import random
 import pygame
-pygame.init()
+import game_loop
 
-screen = pygame.display.set_mode([400, 400])
-pygame.display.set_caption('Hello World')
+
+WIDTH, HEIGHT = 400, 400
+# game logic ticks per second
+TICK_RATE = 60
 
 
 class Snake:
-  def __init__(self):
-    self.x = screen.get_width() // 2
-    self.y = screen.get_height() // 2
+  def __init__(self, width=WIDTH, height=HEIGHT):
+    self.width = width
+    self.height = height
+    self.x = width // 2
+    self.y = height // 2
     self.r = 10
     self.direction = 'RIGHT'
     self.color = (0, 0, 255)
-    self.food_position = (random.randint(10, screen.get_width() - 10),
-                          random.randint(10, screen.get_width() - 10))
+    self.food_position = (random.randint(10, width - 10),
+                          random.randint(10, height - 10))
     self.food_color = (255, 127, 0)
 
   def update_position(self):
@@ -29,9 +37,9 @@ class Snake:
     elif self.direction == 'DOWN':
       self.y += 1
 
-  def draw(self):
-    pygame.draw.circle(screen, self.food_color, self.food_position, 10)
-    pygame.draw.circle(screen, self.color, (self.x, self.y), self.r)
+  def draw(self, screen):
+    return [pygame.draw.circle(screen, self.food_color, self.food_position, 10),
+            pygame.draw.circle(screen, self.color, (self.x, self.y), self.r)]
 
   def update_direction(self, key):
     key_codes = {pygame.K_UP: 'UP',
@@ -49,7 +57,7 @@ class Snake:
         self.direction = target_direction
 
   def hit_wall(self):
-    w, h = screen.get_width(), screen.get_height()
+    w, h = self.width, self.height
     if (self.x - self.r < 0 or self.x + self.r > w or
             self.y - self.r < 0 or self.y + self.r > h):
       self.direction = None
@@ -60,33 +68,53 @@ class Snake:
     return x ** 2 + y ** 2 <= (self.r + 20) ** 2
 
   def eat(self):
-    self.food_position = (random.randint(10, screen.get_width() - 10),
-                          random.randint(10, screen.get_width() - 10))
+    self.food_position = (random.randint(10, self.width - 10),
+                          random.randint(10, self.height - 10))
     self.r += 2
 
+  def step(self):
+    """Advance the game by one tick."""
+    self.update_position()
+    self.hit_wall()
+    if self.is_near_food():
+      self.eat()
+
+
+def main(stats_csv=None):
+  pygame.init()
+  screen = pygame.display.set_mode([WIDTH, HEIGHT])
+  pygame.display.set_caption('Hello World')
 
-s = Snake()
+  s = Snake()
 
-running = True
-while running:
-  for event in pygame.event.get():
-    if event.type == pygame.QUIT:
-      running = False
-    elif event.type == pygame.KEYDOWN:
+  def handle_event(event):
+    if event.type == pygame.KEYDOWN:
       # update the direction
       s.update_direction(event.key)
       # restart the game
       if event.key == pygame.K_r:
         s.__init__()
 
-  screen.fill((255, 255, 255))
-  s.update_position()
-  s.hit_wall()
-  if s.is_near_food():
-    s.eat()
-  s.draw()
-
-  # updates pygame display
-  pygame.display.flip()
-
-pygame.quit()
+  game_loop.run(screen, s.step, s.draw, handle_event, tick_rate=TICK_RATE,
+                stats_csv=stats_csv, dirty_rects=True)
+  pygame.quit()
+
+
+def benchmark(num_ticks=1_000_000):
+  """Run the game logic without rendering and report ticks per second."""
+  s = Snake()
+  start = time.perf_counter()
+  for _ in range(num_ticks):
+    s.step()
+    # restart after hitting a wall so every tick does real work
+    if s.direction is None:
+      s.__init__()
+  elapsed = time.perf_counter() - start
+  print(f'snake: {num_ticks / elapsed:,.0f} ticks/sec')
+
+
+if __name__ == '__main__':
+  if sys.argv[-1] == '--benchmark':
+    benchmark()
+  else:
+    main(game_loop.stats_path(sys.argv))
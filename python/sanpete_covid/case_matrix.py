@@ -0,0 +1,93 @@
+"""Daily case counts and rolling means for every county at once.
+
+The rows of one report are read from the store once and pivoted into a dense
+day x county count matrix. The 7 day rolling mean of all counties comes from
+one vectorized rolling pass over that matrix, and both are cached, so any
+county or date window afterwards is a slice.
+"""
+
+import sys
+import time
+import functools
+import numpy as np
+import pandas as pd
+from case_store import CaseStore, STORE_FILE
+
+
+class CaseMatrix:
+  """Day x county case counts of one report in the store."""
+
+  def __init__(self, store, source=None):
+    self.rows = store.rows(source)
+
+  @functools.cached_property
+  def counts(self):
+    """Cases per day (rows) and county (columns), zero on days without any."""
+    county = self.rows['county'].str.strip().str.upper()
+    date = pd.to_datetime(self.rows['date'], errors='coerce').dt.normalize()
+    # header rows and stray text parse to NaT and are dropped here
+    valid = date.notna() & county.ne('')
+    counts = (pd.DataFrame({'date': date[valid], 'county': county[valid]})
+              .groupby(['date', 'county']).size().unstack(fill_value=0))
+    days = pd.date_range(counts.index.min(), counts.index.max(), freq='D')
+    counts = counts.reindex(days, fill_value=0).astype(np.float64)
+    counts.index.name = 'date'
+    counts.columns.name = 'county'
+    return counts
+
+  @functools.cached_property
+  def rolling(self):
+    """7 day rolling mean of every county, in one pass over the matrix."""
+    return self.counts.rolling('7D').mean()
+
+  @property
+  def counties(self):
+    return list(self.counts.columns)
+
+  def window(self, county, days=None):
+    """Return (counts, rolling mean) of one county, optionally the last days.
+
+    Rolling means near the start of a recent window still average the full
+    7 days, since they are sliced from the whole series.
+    """
+    counts, rolling = self.counts[county], self.rolling[county]
+    if days:
+      cutoff = pd.Timestamp.now() - pd.Timedelta(days=days)
+      counts, rolling = counts[counts.index > cutoff], rolling[rolling.index > cutoff]
+    return counts, rolling
+
+
+def per_county_series(store, source, county):
+  """The per-call groupby/resample/rolling path the matrix replaces."""
+  s = store.dates(county, source)
+  s = s.groupby(s).count()
+  s = s.resample('1D').asfreq().fillna(0)
+  return s, s.rolling('7D').mean()
+
+
+def benchmark(path, source=None):
+  """Time per-county rebuilds against one matrix build plus slices."""
+  store = CaseStore(path)
+  start = time.perf_counter()
+  matrix = CaseMatrix(store, source)
+  matrix.rolling  # pylint: disable=pointless-statement
+  build = time.perf_counter() - start
+  counties = matrix.counties
+
+  start = time.perf_counter()
+  for county in counties:
+    for days in (None, 50):
+      matrix.window(county, days)
+  sliced = time.perf_counter() - start
+
+  start = time.perf_counter()
+  for county in counties:
+    for _ in (None, 50):
+      per_county_series(store, source, county)
+  rebuilt = time.perf_counter() - start
+  print(f'{len(counties)} counties x 2 windows: per county {rebuilt * 1000:.1f} ms, '
+        f'matrix build {build * 1000:.1f} ms + slices {sliced * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+  benchmark(sys.argv[1] if len(sys.argv) > 1 else STORE_FILE)
@@ -0,0 +1,100 @@
+"""SQLite store of parsed CUPH case rows, keyed by report file hash.
+
+Every parsed row is kept as (source, page, county, date), where source is the
+sha256 of the downloaded report and page is the PDF page it came from (0 for
+Excel reports). A report that was parsed before is never parsed again, and a
+PDF that only grew can reuse the pages of the previous report.
+"""
+
+import time
+import sqlite3
+import hashlib
+import pandas as pd
+
+
+STORE_FILE = 'cuph_cases.sqlite'
+
+SCHEMA = '''
+create table if not exists sources (
+  hash text primary key, file_type text, pages integer, added real);
+create table if not exists cases (
+  source text, page integer, county text, date text);
+create index if not exists cases_by_source on cases (source, county, page);
+'''
+
+
+def file_hash(path):
+  """Return the sha256 hex digest of a file's contents."""
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+class CaseStore:
+  """Parsed case rows for every report seen, in one SQLite file."""
+
+  def __init__(self, path=STORE_FILE):
+    self.db = sqlite3.connect(path)
+    self.db.executescript(SCHEMA)
+
+  def has(self, source):
+    row = self.db.execute('select 1 from sources where hash = ?',
+                          (source,)).fetchone()
+    return row is not None
+
+  def latest(self, file_type=None):
+    """Return the hash of the most recently added report, or None."""
+    query = 'select hash from sources'
+    args = ()
+    if file_type:
+      query += ' where file_type = ?'
+      args = (file_type,)
+    row = self.db.execute(query + ' order by added desc limit 1', args).fetchone()
+    return row[0] if row else None
+
+  def pages(self, source):
+    row = self.db.execute('select pages from sources where hash = ?',
+                          (source,)).fetchone()
+    return row[0] if row else 0
+
+  def page_rows(self, source, page):
+    """Return the (county, date) rows parsed from one page, in order."""
+    return self.db.execute(
+        'select county, date from cases where source = ? and page = ? '
+        'order by rowid', (source, page)).fetchall()
+
+  def add(self, source, file_type, rows, pages=0, reuse=None, reuse_pages=0):
+    """Store a report's (page, county, date) rows in one transaction.
+
+    Pages 1..reuse_pages are copied from the already stored report `reuse`
+    instead of being passed in again.
+    """
+    with self.db:
+      if reuse:
+        self.db.execute(
+            'insert into cases select ?, page, county, date from cases '
+            'where source = ? and page <= ? order by rowid',
+            (source, reuse, reuse_pages))
+      self.db.executemany(
+          'insert into cases values (?, ?, ?, ?)',
+          ((source, page, county, str(date)) for page, county, date in rows))
+      self.db.execute('insert into sources values (?, ?, ?, ?)',
+                      (source, file_type, pages, time.time()))
+
+  def dates(self, county='SANPETE', source=None):
+    """Return the notification dates of one county as a datetime Series."""
+    source = source or self.latest()
+    df = pd.read_sql('select date from cases where source = ? and county = ? '
+                     'order by page, rowid', self.db, params=(source, county))
+    return pd.to_datetime(df['date'])
+
+  def rows(self, source=None):
+    """Return the county and date of every row of a report as a DataFrame."""
+    source = source or self.latest()
+    return pd.read_sql('select county, date from cases where source = ? '
+                       'order by page, rowid', self.db, params=(source,))
+
+  def close(self):
+    self.db.close()
@@ -0,0 +1,262 @@
+"""Conditional GET cache for downloading files that rarely change.
+
+ETag and Last-Modified are remembered per url, so a repeat download sends
+If-None-Match / If-Modified-Since and the server can answer 304 with no body.
+Requests go through one pooled requests.Session, and a file on disk is only
+replaced, atomically, when the server sends new content.
+
+Run the offline test with: python http_cache.py --test
+"""
+
+import os
+import sys
+import gzip
+import json
+import hashlib
+import tempfile
+import threading
+import http.server
+import email.utils
+import requests
+
+
+# {url: {'etag': ..., 'last_modified': ..., 'path': ...}}
+CACHE_FILE = 'http_cache.json'
+
+
+class ConditionalCache:
+  """Fetch urls with conditional requests, counting requests and bytes."""
+
+  def __init__(self, cache_file=CACHE_FILE, session=None):
+    self.cache_file = cache_file
+    self.session = session or requests.Session()
+    self.entries = {}
+    if os.path.exists(cache_file):
+      with open(cache_file) as f:
+        self.entries = json.load(f)
+    self.requests = 0
+    self.bytes = 0
+    self.not_modified = 0
+
+  def headers(self, url, path):
+    """Return validators for url, if the copy at path is still there."""
+    entry = self.entries.get(url)
+    if not entry or entry['path'] != path or not os.path.exists(path):
+      return {}
+    headers = {}
+    if entry.get('etag'):
+      headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+      headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+  def get(self, url, path):
+    """Make sure path holds the current content of url.
+
+    Returns True if the file was (re)written and False if the server said
+    the saved copy is still current.
+    """
+    r = self.session.get(url, headers=self.headers(url, path))
+    self.requests += 1
+    self.bytes += transferred_bytes(r)
+    if r.status_code == 304:
+      self.not_modified += 1
+      return False
+    r.raise_for_status()
+
+    # write next to the target so the rename stays on one file system
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.download_')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        f.write(r.content)
+      os.replace(tmp, path)
+    except BaseException:
+      os.remove(tmp)
+      raise
+    self.entries[url] = {'etag': r.headers.get('ETag'),
+                         'last_modified': r.headers.get('Last-Modified'),
+                         'path': path}
+    self.save()
+    return True
+
+  def content(self, url, path):
+    """Return the bytes of url, downloading them only if they changed."""
+    self.get(url, path)
+    with open(path, 'rb') as f:
+      return f.read()
+
+  def save(self):
+    with open(self.cache_file, 'w') as f:
+      json.dump(self.entries, f, indent=2)
+
+  def summary(self):
+    return '{} requests, {} not modified, {:,} bytes transferred'.format(
+        self.requests, self.not_modified, self.bytes)
+
+
+def transferred_bytes(r):
+  """Return the body bytes of a response as sent, before any decoding.
+
+  len(r.content) would count the body after gzip or deflate is undone.
+  """
+  try:
+    return r.raw.tell()
+  except AttributeError:
+    return int(r.headers.get('Content-Length', 0))
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+  """Serve server.files with conditional GETs, and count what was sent.
+
+  ETags are sent unless server.etags is False, in which case only the
+  Last-Modified date in server.modified can validate a copy. Bodies are
+  gzipped for clients that accept it if server.gzip is set.
+  """
+
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    server = self.server
+    server.requests += 1
+    body = server.files.get(self.path)
+    if body is None:
+      self.send_response(404)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    validators = {}
+    if server.etags:
+      validators['ETag'] = '"{}"'.format(hashlib.sha256(body).hexdigest()[:16])
+    if self.path in server.modified:
+      validators['Last-Modified'] = server.modified[self.path]
+    if self.not_modified(validators):
+      self.send_response(304)
+      for name, value in validators.items():
+        self.send_header(name, value)
+      self.end_headers()
+      return
+    self.send_response(200)
+    for name, value in validators.items():
+      self.send_header(name, value)
+    if server.gzip and 'gzip' in self.headers.get('Accept-Encoding', ''):
+      body = gzip.compress(body)
+      self.send_header('Content-Encoding', 'gzip')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+    server.bytes += len(body)
+
+  def not_modified(self, validators):
+    """Whether the request's validators match; If-None-Match wins if sent."""
+    if 'If-None-Match' in self.headers:
+      return self.headers['If-None-Match'] == validators.get('ETag')
+    since = self.headers.get('If-Modified-Since')
+    modified = validators.get('Last-Modified')
+    if not since or not modified:
+      return False
+    return (email.utils.parsedate_to_datetime(modified) <=
+            email.utils.parsedate_to_datetime(since))
+
+  def log_message(self, *args):  # pylint: disable=arguments-differ
+    pass
+
+
+def stand_in_server(files, modified=None, etags=True, gzip_bodies=False):
+  """Start a local HTTP server for {path: bytes} in a background thread.
+
+  `modified` maps paths to their Last-Modified HTTP dates.
+  """
+  server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+  server.files = files
+  server.modified = modified or {}
+  server.etags = etags
+  server.gzip = gzip_bodies
+  server.requests = 0
+  server.bytes = 0
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return server
+
+
+def test_conditional_requests():
+  """Check downloads, 304 reuse and atomic replacement against a local server."""
+  report = os.urandom(200_000)
+  server = stand_in_server({'/report.pdf': report})
+  url = 'http://127.0.0.1:{}/report.pdf'.format(server.server_port)
+  with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, 'cuph_data.pdf')
+    cache = ConditionalCache(os.path.join(tmp, CACHE_FILE))
+
+    assert cache.get(url, path)
+    assert cache.bytes == len(report)
+    mtime = os.stat(path).st_mtime_ns
+
+    # unchanged report: 304, no body, file untouched
+    assert not cache.get(url, path)
+    assert cache.bytes == len(report) and cache.not_modified == 1
+    assert os.stat(path).st_mtime_ns == mtime
+
+    # validators survive a restart
+    restarted = ConditionalCache(os.path.join(tmp, CACHE_FILE))
+    assert not restarted.get(url, path)
+
+    # new report: replaced, and no temp files left behind
+    server.files['/report.pdf'] = report[:1000]
+    assert cache.get(url, path)
+    with open(path, 'rb') as f:
+      assert f.read() == report[:1000]
+    assert sorted(os.listdir(tmp)) == sorted(['cuph_data.pdf', CACHE_FILE])
+
+    # a deleted copy is downloaded again rather than trusted
+    os.remove(path)
+    assert cache.get(url, path)
+    assert os.path.exists(path)
+
+    print('client:', cache.summary())
+    print('server: {} requests, {:,} body bytes sent'.format(
+        server.requests, server.bytes))
+    assert server.requests == 5
+    assert server.bytes == len(report) + 2000
+  server.shutdown()
+  print('test_conditional_requests passed')
+
+
+def test_last_modified():
+  """Check If-Modified-Since reuse, and that gzipped bodies count as sent."""
+  page = b'<html>' + b'<p>case report</p>' * 5000 + b'</html>'
+  monday = email.utils.formatdate(1600000000, usegmt=True)
+  server = stand_in_server({'/page.html': page}, {'/page.html': monday},
+                           etags=False, gzip_bodies=True)
+  url = 'http://127.0.0.1:{}/page.html'.format(server.server_port)
+  with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, 'cuph_page.html')
+    cache = ConditionalCache(os.path.join(tmp, CACHE_FILE))
+
+    assert cache.content(url, path) == page
+    assert cache.entries[url]['etag'] is None
+    assert cache.entries[url]['last_modified'] == monday
+    # the compressed body went over the wire, not the decoded page
+    assert cache.bytes == server.bytes < len(page)
+
+    # same date: 304 on If-Modified-Since alone
+    assert not cache.get(url, path)
+    assert cache.not_modified == 1 and cache.bytes == server.bytes
+
+    # a later date is downloaded again
+    server.files['/page.html'] = page.replace(b'case', b'test')
+    server.modified['/page.html'] = email.utils.formatdate(1600086400, usegmt=True)
+    assert cache.content(url, path) == page.replace(b'case', b'test')
+    assert cache.bytes == server.bytes
+
+    print('client:', cache.summary())
+    print('server: {} requests, {:,} body bytes sent'.format(
+        server.requests, server.bytes))
+    assert server.requests == 3
+  server.shutdown()
+  print('test_last_modified passed')
+
+
+if __name__ == '__main__':
+  if sys.argv[-1] == '--test':
+    test_conditional_requests()
+    test_last_modified()
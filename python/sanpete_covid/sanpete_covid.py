@@ -1,13 +1,21 @@
 """Plot Sanpete COVID cases over time from CUPH data."""
 
 import os
+import sys
 import glob
-import requests
+import time
+import random
+import tempfile
+import concurrent.futures
 import datetime as dt
 from lxml import html
 import tabula
+import pypdf
 import pandas as pd
 import matplotlib.pyplot as plt
+from http_cache import ConditionalCache
+from case_store import CaseStore, file_hash
+from case_matrix import CaseMatrix
 
 
 def get_local_data():
@@ -29,12 +37,15 @@ def is_local_data_current():
   return False
 
 
-def scrape_data_and_save():
-  """Scrape COVID data from CUPH website."""
+def scrape_data_and_save(cuph_url='https://centralutahpublichealth.org/'):
+  """Scrape COVID data from CUPH website.
+
+  Both the landing page and the report are fetched with conditional requests,
+  so unchanged files cost a 304 instead of a full download.
+  """
   print('Requesting data from CUPH website...')
-  cuph_url = 'https://centralutahpublichealth.org/'
-  r = requests.get(cuph_url)
-  tree = html.fromstring(r.content)
+  cache = ConditionalCache()
+  tree = html.fromstring(cache.content(cuph_url, 'cuph_page.html'))
   button = tree.xpath('//div[text()="DETAILED INFO"]')
   button = button[0]  # button is a list
   anchor = button.getparent().getparent()
@@ -42,78 +53,164 @@ def scrape_data_and_save():
 
   # determining if data is pdf or excel format
   file_type = data_url.split('.')[-1]
-  r = requests.get(data_url)
-  with open('cuph_data.' + file_type, 'wb') as f:
-    f.write(r.content)
+  data_path = 'cuph_data.' + file_type
+  if not cache.get(data_url, data_path):
+    # mark the saved copy as checked so it counts as current for another hour
+    os.utime(data_path)
+  # the report may have switched formats; keep only the current one
+  for path in glob.glob('cuph_data*'):
+    if path != data_path:
+      os.remove(path)
+  print(cache.summary())
 
 
-def pdf_to_dates(file):
-  """Use tabula to parse PDF file to a list of dates."""
-  print('Parsing PDF with tabula ...')
+def count_pdf_pages(path):
+  """Return the page count from the PDF's page tree, or 0 if unreadable.
+
+  Callers fall back to parsing every page in one tabula job on 0.
+  """
+  try:
+    return len(pypdf.PdfReader(path).pages)
+  except (pypdf.errors.PyPdfError, ValueError) as e:
+    print('Cannot count PDF pages, parsing serially: {}'.format(e))
+    return 0
+
+
+def pdf_to_rows(file, pages='all', first_page=1, counties=None):
+  """Use tabula to parse PDF pages to (page, county, date) rows.
+
+  With `counties`, only rows of those counties are kept.
+  """
+  print('Parsing PDF pages {} with tabula ...'.format(pages))
   # pdf has dimensions 792 x 612
   # read https://tabula-py.readthedocs.io/en/latest/faq.html#how-can-i-ignore-useless-area
   # setting tabula java options
   options = "--columns 120,240 --area 1,1,560,770"
-  dfs = tabula.read_pdf(file, pages='all', options=options,
+  dfs = tabula.read_pdf(file, pages=pages, options=options,
                         guess=False, pandas_options={'header': None},)
-  dates = []
-  for df in dfs:
-    s = df[df[0] == 'SANPETE'][1]
-    if len(s):
-      dates += s.tolist()
-  return dates
+  rows = []
+  # the fixed area gives one table per page
+  for page, df in enumerate(dfs, first_page):
+    df = df[df[0].notna() & df[1].notna()]
+    if counties is not None:
+      df = df[df[0].isin(counties)]
+    rows += [(page, county, date) for county, date in zip(df[0], df[1])]
+  return rows
 
 
-def excel_to_dates(file):
-  """Use pandas to parse excel file to a list of dates."""
+def pdf_range_rows(path, first, last, counties=None):
+  """Parse one page range; run in a worker process."""
+  return pdf_to_rows(path, '{}-{}'.format(first, last), first, counties)
+
+
+def pdf_to_rows_parallel(path, pages=None, first_page=1, counties=None,
+                         chunk_pages=25, workers=None):
+  """Yield (page, county, date) rows, parsing page ranges concurrently.
+
+  Each worker runs its own tabula job on `chunk_pages` pages and sends back
+  only the filtered rows, never DataFrames, and chunks are yielded in page
+  order as they finish, so memory stays flat however long the report is.
+  Falls back to one serial job when the page count is unknown, or when
+  there is only one worker, since every chunk starts its own JVM.
+  """
+  pages = pages or count_pdf_pages(path)
+  if not pages:
+    yield from pdf_to_rows(path, counties=counties)
+    return
+  if (workers or os.cpu_count()) == 1:
+    yield from pdf_to_rows(path, '{}-{}'.format(first_page, pages), first_page,
+                           counties)
+    return
+  firsts = range(first_page, pages + 1, chunk_pages)
+  lasts = [min(first + chunk_pages - 1, pages) for first in firsts]
+  with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+    for rows in pool.map(pdf_range_rows, [path] * len(firsts), firsts, lasts,
+                         [counties] * len(firsts)):
+      yield from rows
+
+
+def pdf_to_dates(file):
+  """Use tabula to parse PDF file to a list of dates."""
+  return [date for _, _, date in pdf_to_rows_parallel(file, counties=['SANPETE'])]
+
+
+def excel_to_rows(file):
+  """Use pandas to parse excel file to (page, county, date) rows, page 0."""
   print('Parsing EXCEL with pandas ...')
   df = pd.read_excel(file, header=1)
-  s = df[df['COUNTY'] == 'SANPETE']['DATE OF NOTIFICATION']
-  return s.to_list()
+  df = df[df['COUNTY'].notna() & df['DATE OF NOTIFICATION'].notna()]
+  return [(0, county, date) for county, date in
+          zip(df['COUNTY'], df['DATE OF NOTIFICATION'])]
 
 
-def load_data():
-  """Check and load COVID data from file."""
+def excel_to_dates(file):
+  """Use pandas to parse excel file to a list of dates."""
+  return [date for _, county, date in excel_to_rows(file) if county == 'SANPETE']
+
+
+def store_pdf(path, source, store):
+  """Parse a PDF report into the store, reusing pages of the last report.
+
+  The cumulative report grows by appending rows, so if the last stored page
+  of the previous report reads the same now, earlier pages are copied over
+  and only that page onwards goes through tabula.
+  """
+  pages = count_pdf_pages(path)
+  previous = store.latest('pdf')
+  last = store.pages(previous) if previous else 0
+  if not pages or not last or last > pages:
+    store.add(source, 'pdf', pdf_to_rows_parallel(path, pages), pages)
+    return
+  rows = list(pdf_to_rows_parallel(path, pages, first_page=last))
+  old = store.page_rows(previous, last)
+  new = [(county, str(date)) for page, county, date in rows if page == last]
+  if new[:len(old)] == old:
+    store.add(source, 'pdf', rows, pages, reuse=previous, reuse_pages=last - 1)
+  else:
+    store.add(source, 'pdf', pdf_to_rows_parallel(path, pages), pages)
+
+
+def load_data(store):
+  """Check COVID data is current and parsed into the store.
+
+  Returns the hash of the report, which identifies its rows in the store.
+  """
   if not is_local_data_current():
-    # removing anything stored locally
-    data_path = get_local_data()
-    if data_path:
-      os.remove(data_path)
     scrape_data_and_save()
 
   # keeping pyright happy by casting to string
   data_path = get_local_data()
   if data_path is None:
     raise FileNotFoundError('Something wrong! Scraped data not found locally.')
+  source = file_hash(data_path)
+  if store.has(source):
+    print('Report already parsed, reading from store.')
+    return source
   file_type = data_path.split('.')[-1]
-  with open(data_path, 'rb') as f:
-    if file_type == 'pdf':
-      return pdf_to_dates(f)
-    if file_type == 'xlsx':
-      return excel_to_dates(f)
-    else:
-      raise NotImplementedError('Unknown file type of data.')
-
-
-def make_histogram(dates, save=True, recent_only=False):
-  """Cast to pd.Series and plot histogram."""
-  name = 'sanpete'
-  s = pd.Series(dates)
-  s = pd.to_datetime(s)
-  s = s.groupby(s).count()
-  s = s.resample('1D').asfreq().fillna(0)
+  if file_type == 'pdf':
+    store_pdf(data_path, source, store)
+  elif file_type == 'xlsx':
+    with open(data_path, 'rb') as f:
+      store.add(source, 'xlsx', excel_to_rows(f))
+  else:
+    raise NotImplementedError('Unknown file type of data.')
+  return source
+
+
+def make_histogram(matrix, county='SANPETE', save=True, recent_only=False):
+  """Plot a county's daily cases and rolling mean from a CaseMatrix."""
+  name = county.lower()
+  days = None
   if recent_only:
-    cutoff = pd.to_datetime(dt.datetime.now() - dt.timedelta(days=50))
-    s = s[s.index > cutoff]
+    days = 50
     name += '_recent'
-
-  r = s.rolling('7D').mean()
+  s, r = matrix.window(county, days)
 
   fig, ax = plt.subplots(figsize=(12, 6))
   ax.bar(s.index, s)
   ax.plot(r, 'r', linewidth=4)
   plt.xticks(rotation=60)
-  plt.title('Sanpete COVID cases')
+  plt.title('{} COVID cases'.format(county.title()))
   ax.legend(['7 day rolling average', 'case counts'])
   fig.tight_layout()
   if save:
@@ -121,8 +218,78 @@ def make_histogram(dates, save=True, recent_only=False):
   plt.show(block=True)
 
 
+def make_synthetic_report(path, num_pages, rows_per_page=40, seed=0):
+  """Write a landscape PDF laid out like the CUPH case report."""
+  rng = random.Random(seed)
+  counties = ['SANPETE', 'JUAB', 'MILLARD', 'SEVIER', 'PIUTE', 'WAYNE']
+  start = dt.date(2020, 3, 1)
+  objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None,
+             b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+  kids = []
+  for _ in range(num_pages):
+    lines = [b'BT /F1 10 Tf']
+    for i in range(rows_per_page):
+      # x inside the 0-120, 120-240 and 240+ tabula columns, y from the bottom
+      y = 580 - 13 * i
+      date = start + dt.timedelta(days=rng.randrange(400))
+      for x, text in [(20, rng.choice(counties)), (130, f'{date:%m/%d/%Y}'),
+                      (250, rng.choice(['M', 'F']))]:
+        lines.append(f'1 0 0 1 {x} {y} Tm ({text}) Tj'.encode())
+    lines.append(b'ET')
+    stream = b'\n'.join(lines)
+    objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+    objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 792 612] '
+                   b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>'
+                   % (len(objects)))
+    kids.append(b'%d 0 R' % len(objects))
+  objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(kids), num_pages)
+
+  with open(path, 'wb') as f:
+    f.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+      offsets.append(f.tell())
+      f.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+    xref = f.tell()
+    f.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    f.writelines(b'%010d 00000 n \n' % offset for offset in offsets)
+    f.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (len(objects) + 1, xref))
+
+
+def benchmark(num_pages=300):
+  """Compare serial and page-range parallel parsing of a synthetic report."""
+  with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, 'report.pdf')
+    make_synthetic_report(path, num_pages)
+    start = time.perf_counter()
+    serial = pdf_to_rows(path, counties=['SANPETE'])
+    serial_time = time.perf_counter() - start
+    start = time.perf_counter()
+    parallel = list(pdf_to_rows_parallel(path, counties=['SANPETE']))
+    parallel_time = time.perf_counter() - start
+  print(f'{num_pages} pages: serial {serial_time:.1f} sec, '
+        f'parallel {parallel_time:.1f} sec, '
+        f'speedup {serial_time / parallel_time:.1f}x, '
+        f'identical rows: {serial == parallel}')
+
+
+def main(counties=('SANPETE',)):
+  """Plot full and recent histograms of each county from one parse."""
+  case_store = CaseStore()
+  matrix = CaseMatrix(case_store, load_data(case_store))
+  if 'ALL' in counties:
+    counties = matrix.counties
+  for county in counties:
+    print('Total number of {} cases:'.format(county.title()),
+          int(matrix.counts[county].sum()))
+    make_histogram(matrix, county, recent_only=False)
+    make_histogram(matrix, county, recent_only=True)
+
+
 if __name__ == '__main__':
-  dates_list = load_data()
-  print('Total number of cases:', len(dates_list))
-  make_histogram(dates_list, recent_only=False)
-  make_histogram(dates_list, recent_only=True)
+  if sys.argv[-1] == '--benchmark':
+    benchmark()
+  else:
+    # e.g. python sanpete_covid.py juab sevier, or all
+    main([county.upper() for county in sys.argv[1:]] or ['SANPETE'])